@@ -0,0 +1,116 @@
+'''
+This module benchmarks the preprocessing of scraper_preprocesser on a synthetic corpus, without any download:
+the former list-based preprocessing (every chunk held in memory, undesirable paragraphs looked up in a list)
+against the streaming pipeline, with the cleaning in the main process or in a pool of processes.
+It prints the time and the peak memory allocated by Python in the main process for two sizes of corpus:
+the memory of the list-based preprocessing grows with the corpus, the one of the pipeline does not.
+The former preprocessing keeps its own copy of the former splitter (chunks of 1024 characters), so it needs no tokenizer;
+the pipeline packs the sentences by gpt2 tokens and needs the tokenizer (see CHUNK_TOKENIZER in scraper_preprocesser).
+Both only write marx.txt (no pre-tokenized marx.bin), so that they write the same kind of output.
+Run it from this folder: python benchmark_preprocessing.py
+'''
+
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from bs4 import BeautifulSoup as soup
+from scraper_preprocesser import (
+    marxist_text_chunks, marxist_txt, text_cleaner, clean_chunk, undesirable_classes)
+
+WORDS = ('the bourgeoisie proletariat capital labour class struggle history society production workers '
+         'property revolution means wages commodity value market industry state power').split()
+ARTEFACTS = [' [1]', ' (?)', ' [Note by Engels]', ' ...', ' —']
+PAGES_PER_WORK = 10
+PARAGRAPHS_PER_PAGE = 20
+CORPUS_SIZES = (10, 40)  # works
+PROCESSES = max(2, os.cpu_count() or 1)
+
+# Patterns of the former splitter, keeping the whole sentences of a chunk cut in the middle of a paragraph
+no_trunc_sentence_pattern = re.compile(r'\. (.+\w+\.)')
+no_trunc_initial_sentence_pattern = re.compile(r"^[A-Z][a-z]+.+\.")
+
+
+def synthetic_paragraph(rng):
+    '''RETURNS a paragraph of random sentences, sometimes longer than 1024 characters, with some artefacts.'''
+    sentences = []
+    for _ in range(rng.randint(2, 40)):
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 25))).capitalize()
+        sentences.append(sentence + (rng.choice(ARTEFACTS) if rng.random() < 0.2 else '') + '.')
+    return ' '.join(sentences)
+
+
+def synthetic_works(works, seed=0):
+    '''Yields synthetic works as iter_work_pages( ) does, one at a time: (title, URL, LIST of html-pages).'''
+    rng = random.Random(seed)
+    for w in range(works):
+        pages = []
+        for _ in range(PAGES_PER_WORK):
+            navigation = ''.join(f'<p class="{rng.choice(undesirable_classes)}">Next chapter {w}</p>' for _ in range(3))
+            text = ''.join(f'<p>{synthetic_paragraph(rng)}</p>' for _ in range(PARAGRAPHS_PER_PAGE))
+            pages.append(f'<html><body>{navigation}{text}{navigation}</body></html>')
+        yield f'work_{w}', f'https://example.org/work_{w}/', pages
+
+
+def former_text_splitter(raw_work):
+    '''The former splitter of scraper_preprocesser: chunks of 1024 characters, trimmed to their whole sentences.'''
+    for parag in raw_work:
+        if len(parag) > 1024:
+            for sent in re.findall('.{1,1024}', parag):
+                if sent[0].isupper():
+                    new_sent = no_trunc_initial_sentence_pattern.findall(sent)
+                else:
+                    new_sent = no_trunc_sentence_pattern.findall(sent)
+                if len(new_sent) > 0:
+                    yield new_sent[0].strip()
+        else:
+            yield parag
+
+
+def former_preprocessing(works):
+    '''The former preprocessing: lists everywhere, and the whole dataset written at the end.'''
+    chunks = []
+    for _, _, work_pages in works:
+        paragraphs, undesirables = [], []
+        for html in work_pages:
+            text = soup(html, 'html.parser')
+            paragraphs.extend(par.text.replace('\n', ' ').strip() for par in text.find_all('p'))
+            undesirables.extend(par.text.replace('\n', ' ').strip() for par in text.find_all('p', class_=undesirable_classes))
+        chunks.extend(former_text_splitter([x for x in paragraphs if x not in undesirables]))
+    marxist_txt([clean_chunk(chunk) for chunk in chunks], token_dataset=False)
+
+
+def streaming_preprocessing(works, processes):
+    '''The streaming pipeline of scraper_preprocesser.'''
+    marxist_txt(text_cleaner(marxist_text_chunks(works), processes), token_dataset=False)
+
+
+def measure(preprocess, works):
+    '''RETURNS the time (seconds) and the peak memory allocated by Python (MB) of a preprocessing of the synthetic corpus.'''
+    start = time.perf_counter()
+    preprocess(synthetic_works(works))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    preprocess(synthetic_works(works))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak / 2**20
+
+
+if __name__ == '__main__':
+
+    os.chdir(tempfile.mkdtemp())  # the preprocessing writes its txt files into the working directory
+    runs = [('former lists', former_preprocessing),
+            ('streaming, 1 process', lambda works: streaming_preprocessing(works, 1)),
+            (f'streaming, {PROCESSES} processes', lambda works: streaming_preprocessing(works, PROCESSES))]
+
+    results = {(name, works): measure(preprocess, works) for works in CORPUS_SIZES for name, preprocess in runs}
+
+    print(f"{'preprocessing':<26}" + ''.join(f"{f'{works} works: time (s)':>22}{'peak (MB)':>11}" for works in CORPUS_SIZES))
+    for name, _ in runs:
+        print(f'{name:<26}' + ''.join(f'{results[name, works][0]:>22.2f}{results[name, works][1]:>11.1f}'
+                                      for works in CORPUS_SIZES))
@@ -0,0 +1,151 @@
+'''
+This module downloads the HTML pages of the marxist works for the module scraper_preprocesser:
+the pages are fetched by a pool of threads, with at most PER_HOST_LIMIT requests at a time to the same host,
+and kept in an on-disk HTTP cache. A cached page is revalidated with its ETag / Last-Modified headers,
+so that a re-run only downloads the pages that have changed, and does not need the network at all in offline mode.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(levelname)s: %(message)s')
+
+CACHE_FOLDER = os.getenv('SCRAPER_CACHE', 'training_dataset/http_cache/')
+OFFLINE = os.getenv('SCRAPER_OFFLINE', '0') == '1'  # serve the pages from the cache only
+FETCH_WORKERS = int(os.getenv('SCRAPER_WORKERS', '8'))  # pages downloaded at the same time
+PER_HOST_LIMIT = int(os.getenv('SCRAPER_PER_HOST', '2'))  # requests at the same time to one host, to stay polite
+TIMEOUT = 30  # seconds
+
+
+class PageCache:
+    '''
+    On-disk cache of HTTP responses keyed by URL: for each URL, the body of the page
+    and a JSON file with its validators (ETag, Last-Modified) and its encoding.
+    '''
+
+    def __init__(self, folder=CACHE_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def paths(self, url):
+        '''RETURNS the paths of the body and of the metadata of a URL in the cache.'''
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, f'{key}.html'), os.path.join(self.folder, f'{key}.json')
+
+    def load(self, url):
+        '''RETURNS the cached body (STRING) and metadata (DICTIONARY) of a URL, or (None, None) if it is not cached.'''
+        body_path, meta_path = self.paths(url)
+        if not (os.path.exists(body_path) and os.path.exists(meta_path)):
+            return None, None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(body_path, 'rb') as f:
+            return f.read().decode(meta['encoding'] or 'utf-8', errors='replace'), meta
+
+    def save(self, url, response):
+        '''Stores a 200 response; the metadata is written last, so that a half-written entry is never loaded.'''
+        body_path, meta_path = self.paths(url)
+        meta = {'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'encoding': response.encoding or response.apparent_encoding}
+        with open(body_path, 'wb') as f:
+            f.write(response.content)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+
+def create_session(pool_size=FETCH_WORKERS):
+    '''RETURNS a requests Session retrying the failed requests with exponential backoff, with a connection pool
+    large enough for the pool of threads.'''
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_page(url, session, cache, host_slots, offline=OFFLINE):
+    '''
+    Downloads a page, or revalidates its cached copy with a conditional request.
+    RETURNS the HTML of the page (STRING), or None if it could not be obtained.
+    -----------
+    ARGUMENTS: the URL, the requests Session, the PageCache, the DICTIONARY host -> semaphore
+    limiting the requests to each host, and whether to stay offline (cache only).
+    '''
+    cached, meta = cache.load(url)
+    if offline:
+        if cached is None:
+            logging.warning(f'{url} is not in the cache: it cannot be read offline.')
+        return cached
+
+    headers = {}
+    if meta is not None:
+        if meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        with host_slots[urlparse(url).netloc]:
+            html = session.get(url, headers=headers, timeout=TIMEOUT)
+    except requests.RequestException as error:
+        if cached is not None:
+            logging.warning(f'Could not revalidate {url} ({error}): using the cached copy.')
+        else:
+            logging.warning(f'Download of {url} failed ({error}).')
+        return cached
+
+    if html.status_code == 304 and cached is not None:
+        return cached
+    if html.status_code != 200:
+        logging.warning(f'Download of {url} failed with status code {html.status_code}. Please verify that the URL exists.')
+        return None
+
+    cache.save(url, html)
+    return html.text
+
+
+def iter_pages(urls, offline=OFFLINE, max_workers=FETCH_WORKERS, per_host=PER_HOST_LIMIT):
+    '''
+    Fetches pages concurrently, through the on-disk cache (see fetch_page( )), and yields them in the order of the URLs.
+    Only a window of 2 * max_workers pages is requested ahead of the one being yielded,
+    so that the pages waiting to be processed stay few however long the list of URLs is.
+    This is a generator: it yields a (URL, HTML of the page) tuple per URL (None for the pages that could not be obtained).
+    -----------
+    ARGUMENTS: an ITERABLE of URLs, whether to stay offline, the number of threads and the requests per host at a time.
+    '''
+    cache = PageCache()
+    session = create_session(max_workers)
+    host_slots = {}  # host -> semaphore, created before the first request to the host
+    window = deque()
+    obtained = 0
+    requested = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for url in urls:
+            host_slots.setdefault(urlparse(url).netloc, threading.BoundedSemaphore(per_host))
+            window.append((url, executor.submit(fetch_page, url, session, cache, host_slots, offline)))
+            requested += 1
+            if len(window) >= 2 * max_workers:
+                done_url, future = window.popleft()
+                obtained += future.result() is not None
+                yield done_url, future.result()
+        while window:
+            done_url, future = window.popleft()
+            obtained += future.result() is not None
+            yield done_url, future.result()
+
+    logging.info(f'{obtained}/{requested} pages obtained{" from the cache (offline)" if offline else ""}.')
+
@@ -1,15 +1,27 @@
 '''
 This module scrapes the data from the "Marx Engels Archive"
-and preprocesses it for the fine-tuning of a gpt2 model
+and preprocesses it for the fine-tuning of a gpt2 model.
+The preprocessing is a pipeline of generators (download -> parse and filter -> split -> clean -> write),
+so that the text streams into marx.txt and the memory used does not grow with the size of the corpus.
+The same pass writes marx.bin, the dataset already tokenized for gpt2, to be memory-mapped by token_dataset.TokenDataset.
 '''
 
-import requests 
 import logging
 import os 
 import re
-import time
-from tqdm import tqdm, trange
+import sys
+from contextlib import ExitStack
+from itertools import islice
+from multiprocessing import Pool
+from tqdm import tqdm
 from bs4 import BeautifulSoup as soup
+from corpus_fetcher import OFFLINE, iter_pages
+from token_dataset import TokenDatasetWriter
+from transformers import GPT2TokenizerFast
+
+# The regex cleanup is shared with the services of the press review
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'marxist_press_review', 'shared'))
+from text_cleanup import clean_training_text
 
 logging.basicConfig(level=logging.INFO,
                     format='%(levelname)s: %(message)s')
@@ -27,172 +39,297 @@ marxist_works = {'manifesto':('https://marxists.architexturez.net/archive/marx/w
                 }
 
 
-def text_splitter(raw_work, cleaned_works):
+# Number of gpt2 tokens per chunk of the training dataset (gpt2 reads 1024 tokens at most),
+# and the tokenizer counting them (a name on the Hugging Face hub or a local folder;
+# in offline mode, it must be a local folder or already be in the cache of Hugging Face)
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '1024'))
+CHUNK_TOKENIZER = os.getenv('CHUNK_TOKENIZER', 'gpt2')
+sentence_end_pattern = re.compile(r'(?<=[.!?])\s+')
+
+_tokenizer = None
+
+
+def get_tokenizer():
+    '''Loads the gpt2 tokenizer the first time it is needed (without any network access in offline mode), and RETURNS it.'''
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = GPT2TokenizerFast.from_pretrained(CHUNK_TOKENIZER, local_files_only=OFFLINE)
+    return _tokenizer
+
+
+def text_splitter(raw_work, token_budget=CHUNK_TOKENS, token_stats=None):
     '''
-    Takes a LIST OF STRINGS containing paragraphs of a marxist work,
-    and splits them in chunks of 1024 characters (i.e. the max length accepted by gpt2);
-    Gets rid of trailing parts of words or sentences that may have remained in each paragraph.
-    RETURNS a LIST OF STRINGS containing the new paragraphs.
+    Takes an ITERABLE OF STRINGS containing paragraphs of a marxist work,
+    splits them into sentences and packs the whole sentences, in order, into chunks of token_budget gpt2 tokens at most,
+    so that each chunk fills the context of gpt2 as much as possible without cutting a sentence.
+    The sentences of the work are tokenized in a single batch. A sentence longer than the budget on its own
+    is cut into pieces of token_budget tokens at most, between two words (see word_pieces( )).
+    This is a generator: it yields the chunks (STRINGS) one by one.
+    -----------
+    ARGUMENTS: the paragraphs of a work, the number of tokens per chunk,
+    and optionally a DICTIONARY of token counters (see new_token_stats( )) updated with each chunk.
     '''
-    
-    no_trunc_sentence_pattern = r'\. (.+\w+\.)'
-    no_trunc_initial_sentence_pattern = r"^[A-Z][a-z]+.+\."
-
-    for parag in raw_work:
-        if len(parag) > 1024: 
-            split_par = re.findall('.{1,1024}', parag)
-            for sent in split_par:
-                if sent[0].isupper():
-                    new_sent = re.findall(no_trunc_initial_sentence_pattern, sent)
-                    if len(new_sent) > 0:
-                        cleaned_works.append(new_sent[0].strip())                                      
-                else:
-                    new_sent = re.findall(no_trunc_sentence_pattern, sent)
-                    if len(new_sent) > 0:
-                        cleaned_works.append(new_sent[0].strip()) 
-        else:
-            cleaned_works.append(parag)
-    
-    return cleaned_works
-    
+    sentences = [sentence for parag in raw_work for sentence in sentence_end_pattern.split(parag.strip()) if sentence]
+    if not sentences:
+        return
+    tokenizer = get_tokenizer()
+    # with their leading space, the tokens of the sentences add up to those of the chunk
+    sentence_ids = tokenizer([f' {sentence}' for sentence in sentences], add_special_tokens=False)['input_ids']
 
-def get_marxist_text(works_dictionary):
+    chunk, chunk_tokens = [], 0
+    for sentence, ids in zip(sentences, sentence_ids):
+        if chunk and chunk_tokens + len(ids) > token_budget:
+            yield count_chunk_tokens(' '.join(chunk), chunk_tokens, token_stats)
+            chunk, chunk_tokens = [], 0
+        if len(ids) > token_budget:
+            for piece in word_pieces(ids, token_budget, tokenizer):
+                yield count_chunk_tokens(tokenizer.decode(piece).strip(), len(piece), token_stats)
+            continue
+        chunk.append(sentence)
+        chunk_tokens += len(ids)
+    if chunk:
+        yield count_chunk_tokens(' '.join(chunk), chunk_tokens, token_stats)
+
+
+def word_pieces(ids, token_budget, tokenizer):
     '''
-    Scrapes marxist works from 'https://marxists.architexturez.net/,
-    polishes them,
-    and writes them into txt files.
+    Cuts the tokens of a sentence longer than token_budget into pieces of token_budget tokens at most,
+    each one ending before a token that starts a word ('Ġ', a leading space, in the byte-level BPE of gpt2),
+    so that neither a word nor a multi-byte character is split between two pieces.
+    Only a single word longer than the budget is cut at an arbitrary token, and may then decode lossily.
+    RETURNS the LIST of pieces (LISTS of token ids).
+    '''
+    tokens = tokenizer.convert_ids_to_tokens(ids)
+    pieces = []
+    start = 0
+    while len(ids) - start > token_budget:
+        end = start + token_budget
+        cut = next((i for i in range(end, start, -1) if tokens[i].startswith('Ġ')), end)
+        pieces.append(ids[start:cut])
+        start = cut
+    pieces.append(ids[start:])
+    return pieces
+
+
+def new_token_stats():
+    '''RETURNS empty counters of the tokens per chunk, to be filled by text_splitter( ).'''
+    return {'chunks': 0, 'tokens': 0, 'min': None, 'max': 0}
+
+
+def count_chunk_tokens(chunk, tokens, token_stats):
+    '''Adds the tokens of a chunk to the counters (if any), and RETURNS the chunk.'''
+    if token_stats is not None:
+        token_stats['chunks'] += 1
+        token_stats['tokens'] += tokens
+        token_stats['min'] = tokens if token_stats['min'] is None else min(token_stats['min'], tokens)
+        token_stats['max'] = max(token_stats['max'], tokens)
+    return chunk
+
+
+def log_token_stats(token_stats, token_budget=CHUNK_TOKENS):
+    '''Logs the number of tokens per chunk, and how much of the context of gpt2 the chunks fill on average.'''
+    if not token_stats['chunks']:
+        return
+    mean = token_stats['tokens'] / token_stats['chunks']
+    logging.info(f"{token_stats['chunks']} chunks of {mean:.0f} tokens on average "
+                 f"(min {token_stats['min']}, max {token_stats['max']}): {mean / token_budget:.0%} of the {token_budget}-token budget.")
     
-    Also produces a LIST OF STRINGS containing text from the input marxist works, already split in
-    chunks long enough to be used to fine tune a gpt2 model.
+
+# Pages whose HTML has a faulty nested structure that produces paragraph multiplication while parsing
+faulty_pages = {'https://marxists.architexturez.net/archive/marx/works/1847/wage-labour/ch02.htm',
+                'https://marxists.architexturez.net/archive/marx/works/1847/wage-labour/ch03.htm'}
+undesirable_classes = ['info','information','skip','footer','title','fst','next','inline']
+
+# Number of processes cleaning the chunks of text (1: cleaned by the main process), and chunks sent at a time
+CLEANING_PROCESSES = int(os.getenv('CLEANING_PROCESSES', '1'))
+CLEANING_BATCH = 256
+
+# Whether to write the pre-tokenized dataset marx.bin next to marx.txt (see token_dataset), and chunks tokenized at a time
+TOKEN_DATASET = os.getenv('TOKEN_DATASET', '1') == '1'
+TOKENIZING_BATCH = 256
+
+
+def work_page_urls(contents_url, page_num):
+    '''RETURNS the LIST of the URLs of the html-pages of a marxist work, the faulty pages excluded.'''
+    if page_num == 1:
+        return [contents_url]
     
+    return [address for address in (f'{contents_url}ch0{page}.htm' for page in range(1, page_num+1))
+            if address not in faulty_pages]
+
+
+def iter_work_pages(works_dictionary, offline=OFFLINE):
+    '''
+    Downloads the html-pages of the marxist works (see corpus_fetcher.iter_pages( )), and yields them work by work.
+    The pages of a work that follow a page that could not be obtained are left out, as they would not follow on.
+    This is a generator: it yields a (title, URL of the page of contents, LIST of the html-pages) tuple per work.
     -----------
-    ARGUMENT: 
-    A dictionary of tuples: the dictionary key is the title of the resulting .txt file for a marxist work,
-    the first element of the tuple is the URL of chosen work's page of contents,
-    the third is the number of html-pages linked to that page of contents.
+    ARGUMENTS: the dictionary of the marxist works (see get_marxist_text( )), and whether to read the pages from the cache only.
+    '''
+    work_urls = {el: work_page_urls(*works_dictionary[el]) for el in works_dictionary}
+    pages = iter_pages((url for urls in work_urls.values() for url in urls), offline=offline)
+
+    for el, urls in work_urls.items():
+        work_pages = [html for _, html in islice(pages, len(urls))]
+        if None in work_pages:
+            work_pages = work_pages[:work_pages.index(None)]
+        yield el, works_dictionary[el][0], work_pages
+
+    for _ in pages:  # nothing left: closes the pool of downloads and logs their summary
+        pass
+
+
+def parse_work(work_pages):
+    '''
+    Takes the LIST of the html-pages of a marxist work,
+    and RETURNS the LIST of its paragraphs, without those that are not part of the work (information, navigation, titles...).
+    '''
+    paragraphs = []
+    undesirables = set()
+    for html in work_pages:
+        text = soup(html,'html.parser')    
+
+        for par in text.find_all('p'):
+            par_text = par.text.replace('\n',' ').strip()    
+            paragraphs.append(par_text)
+
+        for par in text.find_all('p', class_=undesirable_classes):
+            par_text = par.text.replace('\n',' ').strip()
+            undesirables.add(par_text)
+
+    return [x for x in paragraphs if x not in undesirables]
+
+
+def marxist_text_chunks(works):
+    '''
+    Takes the marxist works as produced by iter_work_pages( ),
+    writes the text of each one into a txt file,
+    and yields their text, already split in chunks of whole sentences filling the context of gpt2 (see text_splitter( )),
+    then logs the number of tokens per chunk.
+    Only one work is held in memory at a time.
     '''
-    
-    cleaner_marxist_text = []
     counter = 0
+    token_stats = new_token_stats()
     path = 'training_dataset/raw_texts/'
     if not os.path.exists(path):
         os.makedirs(path)
-            
-    for el in works_dictionary:
-        filename = str(el)
-        contents_url = works_dictionary[el][0]
-        page_num = works_dictionary[el][1]    
-        paragraphs = []
-        undesirables = []
-        
-        if page_num == 1:
-            html = requests.get(contents_url)
-            if html.status_code != 200:
-                logging.warning(f"Download of {contents_url} failed with status code {html.status_code}. Please verify that the URL exists.")
-            else:
-                text = soup(html.text,'html.parser')    
-
-                for par in text.find_all('p'):
-                    par_text = par.text.replace('\n',' ').strip()    
-                    paragraphs.append(par_text)
-
-                for par in text.find_all('p', class_=['info','information','skip','footer','title','fst','next','inline']):
-                    par_text = par.text.replace('\n',' ').strip()
-                    undesirables.append(par_text)
-
-                work = [x for x in paragraphs if x not in undesirables]
-                if work:
-                    cleaner_marxist_text = text_splitter(work, cleaner_marxist_text)
-                    with open(f'{path+filename}.txt', 'w') as f:
-                        f.writelines(work)
-                    for i in trange(1):
-                        time.sleep(0.25)
-                    logging.info(f'Text from {contents_url} successfully downloaded into "{path+filename}.txt".')
-                    counter += 1
-
-        else:
-            
-            for page in trange(1,page_num+1):
-                
-                address = f'''{contents_url}ch0{page}.htm'''
-                if address == 'https://marxists.architexturez.net/archive/marx/works/1847/wage-labour/ch02.htm': 
-                    continue
-                elif address == 'https://marxists.architexturez.net/archive/marx/works/1847/wage-labour/ch03.htm':    
-                    continue #the HTML of these 2 pages has a faulty nested structure that produces paragraph multiplication while parsing.
-                html = requests.get(address)
-                if html.status_code != 200:
-                    logging.warning(f"Download of {contents_url} failed with status code {html.status_code}. Please verify that the URL exists.")
-                    break
-                        
-                text = soup(html.text,'html.parser')    
-
-                for par in text.find_all('p'):
-                    par_text = par.text.replace('\n',' ').strip()    
-                    paragraphs.append(par_text)
-                    
-                for par in text.find_all('p', class_=['info','information','skip','footer','title','fst','next','inline']):
-                    par_text = par.text.replace('\n',' ').strip()
-                    undesirables.append(par_text)
-
-            work = [x for x in paragraphs if x not in undesirables]
-            if work:
-                cleaner_marxist_text = text_splitter(work, cleaner_marxist_text)
-                with open(f'{path+filename}.txt', 'w') as f:
-                    f.writelines(work)
-                
-                logging.info(f'Text from {contents_url} successfully downloaded into "{path+filename}.txt".')
-                counter += 1  
-        
+
+    for filename, contents_url, work_pages in works:
+        work = parse_work(work_pages)
+        if work:
+            with open(f'{path+filename}.txt', 'w') as f:
+                f.writelines(work)
+            logging.info(f'Text from {contents_url} successfully downloaded into "{path+filename}.txt".')
+            counter += 1
+            yield from text_splitter(work, token_stats=token_stats)
+
     logging.info(f'{counter} works downloaded into the folder "{path}".')
-    
-    return cleaner_marxist_text
-    
+    log_token_stats(token_stats)
+
 
-def text_cleaner(paragraphs_list):
-    '''takes the final LIST of marxist text chunks and cleans it with RegEx.'''
+def get_marxist_text(works_dictionary, offline=OFFLINE):
+    '''
+    Scrapes marxist works from 'https://marxists.architexturez.net/,
+    polishes them,
+    and writes them into txt files.
+    The html-pages are downloaded concurrently and kept in an on-disk HTTP cache (see corpus_fetcher),
+    so that a re-run only downloads the pages that have changed, or none at all in offline mode.
     
-    logging.info('Final cleaning starts now...')
-    regex = {r"\\'":"’",
-        r'\[.+?\]':'',
-        r'  [0-9]+.':'',
-        r'\(\?\)':'',
-        r'\([0-9]{1,2}\)':'',
-        r'[<>]':'',
-        r'\.+':'.',
-        r' \. ':'. ',
-        r'\|\|[A-Z]+\|':'',
-        r' {2,}':' '}
+    This is a generator: it yields the text from the input marxist works, already split in
+    chunks long enough to be used to fine tune a gpt2 model (STRINGS).
     
-    for key,index in regex.items():
-        paragraphs_list = [f"{re.sub(key,index,par)} " for par in tqdm(paragraphs_list)]
-        
-    logging.info('All cleaning done.')
-    return paragraphs_list
+    -----------
+    ARGUMENTS: 
+    1) A dictionary of tuples: the dictionary key is the title of the resulting .txt file for a marxist work,
+    the first element of the tuple is the URL of chosen work's page of contents,
+    the third is the number of html-pages linked to that page of contents;
+    2) whether to read the pages from the cache only.
+    '''
+    return marxist_text_chunks(iter_work_pages(works_dictionary, offline))
     
 
-def marxist_txt(clean_chunks):
-    '''creates the final TXT file to be used as a training dataset for the gpt2 model'''
+def clean_chunk(chunk):
+    '''Cleans a chunk of marxist text with RegEx (see text_cleanup.PREPROCESSING_REGEX), and RETURNS it followed by a space.'''
+    return f"{clean_training_text(chunk)} "
+
+
+def text_cleaner(chunks, processes=CLEANING_PROCESSES):
+    '''
+    Takes the marxist text chunks (an ITERABLE OF STRINGS) and cleans them with RegEx (see clean_chunk( )).
+    With more than one process, the chunks are cleaned by a pool of processes, CLEANING_BATCH chunks per process at a time.
+    This is a generator: it yields the clean chunks in order.
+    '''
+    if processes <= 1:
+        yield from map(clean_chunk, chunks)
+        return
+
+    chunks = iter(chunks)
+    with Pool(processes) as pool:
+        while True:
+            batch = list(islice(chunks, processes * CLEANING_BATCH))  # bounds the chunks in flight
+            if not batch:
+                break
+            yield from pool.map(clean_chunk, batch, chunksize=CLEANING_BATCH)
+    
+
+def tokenize_into(dataset, chunks):
+    '''
+    Tokenizes a LIST of clean chunks in a single batch, and appends them to the pre-tokenized dataset (if any).
+    Each chunk is tokenized with a leading space, as it follows the previous one in marx.txt
+    and as text_splitter( ) counted its tokens.
+    RETURNS the LIST of the numbers of tokens of the clean chunks (empty without a dataset).
+    '''
+    if dataset is None or not chunks:
+        return []
+    lengths = []
+    for ids in get_tokenizer()([f' {chunk.strip()}' for chunk in chunks], add_special_tokens=False)['input_ids']:
+        dataset.add(ids)
+        lengths.append(len(ids))
+    return lengths
+
+
+def marxist_txt(clean_chunks, token_dataset=TOKEN_DATASET):
+    '''
+    creates the final TXT file to be used as a training dataset for the gpt2 model, writing the chunks as they come,
+    and in the same pass the pre-tokenized dataset marx.bin (see token_dataset), TOKENIZING_BATCH chunks at a time
+    '''
     
     other_path = 'training_dataset/preprocessed/'
     if not os.path.exists(other_path):
         os.makedirs(other_path)
         
     count = 0
-    for el in clean_chunks:
-        count = count + len(el)
+    chunk_count = 0
+    chunk_tokens = []  # tokens of each clean chunk, only known when marx.bin is written
+    with ExitStack() as stack:
+        dataset = None
+        if token_dataset:
+            tokenizer = get_tokenizer()
+            dataset = stack.enter_context(
+                TokenDatasetWriter(f'{other_path}marx.bin', len(tokenizer), tokenizer.eos_token_id))
+        f = stack.enter_context(open(f'{other_path}marx.txt', 'w'))
+        batch = []
+        for el in tqdm(clean_chunks, unit=' chunks'):
+            f.write(el)
+            count += len(el)
+            chunk_count += 1
+            batch.append(el)
+            if len(batch) == TOKENIZING_BATCH:
+                chunk_tokens.extend(tokenize_into(dataset, batch))
+                batch = []
+        chunk_tokens.extend(tokenize_into(dataset, batch))
     
-    logging.info(f'The training dataset has {len(clean_chunks)} chunks of text:\nThey are all shorter than 1024 characters; the training dataset is {count} characters long in total.')
-    
-
-    with open(f'{other_path}marx.txt', 'w') as f:
-                    f.writelines(clean_chunks)
-    
-    logging.info(f'A TXT file containing the training dataset may now be found into the folder "{other_path}".')
+    # text_splitter( ) counts the tokens before the cleaning, which can change them a little
+    if chunk_tokens:
+        over_budget = sum(tokens > CHUNK_TOKENS for tokens in chunk_tokens)
+        token_summary = (f'Once cleaned, they are at most {max(chunk_tokens)} gpt2 tokens long '
+                         f'({over_budget} over the {CHUNK_TOKENS}-token budget)')
+    else:
+        token_summary = f'They were cut to about {CHUNK_TOKENS} gpt2 tokens at most, counted before the cleaning'
+    logging.info(f'The training dataset has {chunk_count} chunks of text:\n{token_summary}; the training dataset is {count} characters long in total.')
+    logging.info(f'A TXT file containing the training dataset{" and its pre-tokenized copy marx.bin" if token_dataset else ""} may now be found into the folder "{other_path}".')
     
 if __name__=='__main__':
 
-    logging.info('Starting the scraping from the "Marx Engels Archive"')
-    final_bits = text_cleaner(get_marxist_text(marxist_works))
-    marxist_txt(final_bits)
-
-
+    logging.info(f'Starting the scraping from the "Marx Engels Archive"{" (offline, from the cache)" if OFFLINE else ""}')
+    marxist_txt(text_cleaner(get_marxist_text(marxist_works)))
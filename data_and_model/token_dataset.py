@@ -0,0 +1,150 @@
+'''
+This module contains the pre-tokenized training dataset written by scraper_preprocesser next to marx.txt,
+so that the fine-tuning and the inspection of the dataset do not need to tokenize the text again.
+The file holds, in this order:
+1) a header of HEADER_SIZE bytes: magic string, version, vocabulary size, end-of-text token,
+number of chunks, number of tokens and position of the index;
+2) the tokens of all the chunks, each one followed by the end-of-text token, as a flat array of uint16;
+3) the index: the position (uint64) of the first token of each chunk, plus the total number of tokens.
+The loader memory-maps the file: the tokens are read by the operating system only when they are used, without copies.
+'''
+
+import logging
+import os
+import struct
+import tempfile
+import numpy as np
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(levelname)s: %(message)s')
+
+MAGIC = b'MARXTOK\x00'
+VERSION = 1
+HEADER_FORMAT = '<8sIIIQQQ'  # magic, version, vocab size, end-of-text token, chunks, tokens, index position (bytes)
+HEADER_SIZE = 64
+TOKEN_DTYPE = np.dtype('<u2')
+OFFSET_DTYPE = np.dtype('<u8')
+
+
+class TokenDatasetWriter:
+    '''
+    Writes the pre-tokenized dataset chunk by chunk: the tokens go straight into the file
+    and the index into a temporary file, appended to the tokens when the writer is closed.
+    To be used as a context manager: the header and the index are only written if the writing succeeds;
+    if it stops on an exception, the file is closed with its blank header, so that it cannot be loaded
+    as a complete dataset.
+    '''
+
+    def __init__(self, path, vocab_size, eos_token_id):
+        if vocab_size > np.iinfo(TOKEN_DTYPE).max + 1:
+            raise ValueError(f'A vocabulary of {vocab_size} tokens does not fit in {TOKEN_DTYPE.name}.')
+        self.path = path
+        self.vocab_size = vocab_size
+        self.eos_token_id = eos_token_id
+        self.chunks = 0
+        self.tokens = 0
+        self.file = open(path, 'wb')
+        self.file.write(b'\0' * HEADER_SIZE)  # written for good when the counts are known
+        self.index = tempfile.TemporaryFile()
+
+    def add(self, token_ids):
+        '''Appends a chunk (a LIST of token ids) to the dataset, followed by the end-of-text token.'''
+        self.index.write(np.array([self.tokens], dtype=OFFSET_DTYPE).tobytes())
+        self.file.write(np.array(list(token_ids) + [self.eos_token_id], dtype=TOKEN_DTYPE).tobytes())
+        self.chunks += 1
+        self.tokens += len(token_ids) + 1
+
+    def close(self):
+        '''Appends the index to the tokens and writes the header.'''
+        self.index.write(np.array([self.tokens], dtype=OFFSET_DTYPE).tobytes())
+        index_position = HEADER_SIZE + self.tokens * TOKEN_DTYPE.itemsize
+        self.index.seek(0)
+        while True:
+            block = self.index.read(1 << 20)
+            if not block:
+                break
+            self.file.write(block)
+        self.index.close()
+
+        self.file.seek(0)
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.vocab_size, self.eos_token_id,
+                                    self.chunks, self.tokens, index_position))
+        self.file.close()
+        logging.info(f'{self.chunks} chunks ({self.tokens} tokens) written into the pre-tokenized dataset "{self.path}".')
+
+    def abort(self):
+        '''Closes the files without writing the index nor the header: the dataset is left unreadable.'''
+        self.index.close()
+        self.file.close()
+        logging.warning(f'The pre-tokenized dataset "{self.path}" is incomplete: it was left without a header.')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_header(path):
+    '''RETURNS the header of a pre-tokenized dataset as a DICTIONARY.'''
+    with open(path, 'rb') as f:
+        fields = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+    magic, version, vocab_size, eos_token_id, chunks, tokens, index_position = fields
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'"{path}" is not a pre-tokenized dataset of version {VERSION}.')
+
+    return {'vocab_size': vocab_size, 'eos_token_id': eos_token_id, 'chunks': chunks, 'tokens': tokens,
+            'index_position': index_position}
+
+
+class TokenDataset:
+    '''
+    Pre-tokenized dataset memory-mapped from its file, read as fixed-length training blocks:
+    block i holds the tokens [i * stride, i * stride + block_size) of the flat array, the last incomplete block left out.
+    It has a length and is indexable, so that it can be handed to a torch DataLoader with collate_fn=TokenDataset.collate:
+    the blocks are read-only views into the file, copied only once, when a batch is built.
+    '''
+
+    def __init__(self, path, block_size=1024, stride=None):
+        self.header = read_header(path)
+        self.block_size = block_size
+        self.stride = stride or block_size
+        self.tokens = np.memmap(path, dtype=TOKEN_DTYPE, mode='r', offset=HEADER_SIZE, shape=(self.header['tokens'],))
+        self.offsets = np.memmap(path, dtype=OFFSET_DTYPE, mode='r', offset=self.header['index_position'],
+                                 shape=(self.header['chunks'] + 1,))
+
+    def __len__(self):
+        if self.header['tokens'] < self.block_size:
+            return 0
+        return (self.header['tokens'] - self.block_size) // self.stride + 1
+
+    def __getitem__(self, i):
+        '''RETURNS the block i: a read-only view of block_size tokens into the memory-mapped file.'''
+        if not 0 <= i < len(self):
+            raise IndexError(f'Block {i} out of range ({len(self)} blocks).')
+        start = i * self.stride
+        return self.tokens[start:start + self.block_size]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @staticmethod
+    def collate(blocks):
+        '''RETURNS a LIST of blocks copied into a (blocks, block_size) array of int64, the type of the input ids of gpt2,
+        converted on the fly (torch.from_numpy( ) turns it into a tensor without copying it).'''
+        return np.array(blocks, dtype=np.int64)
+
+    def chunk(self, i):
+        '''RETURNS the tokens of the chunk i, without its end-of-text token.'''
+        return self.tokens[self.offsets[i]:self.offsets[i + 1] - 1]
+
+
+def describe(path, block_size=1024):
+    '''Logs the header of a pre-tokenized dataset and the number of training blocks it makes.'''
+    dataset = TokenDataset(path, block_size)
+    logging.info(f'"{path}": {dataset.header["chunks"]} chunks, {dataset.header["tokens"]} tokens '
+                 f'({os.path.getsize(path) / 2**20:.1f} MB), {len(dataset)} blocks of {block_size} tokens.')
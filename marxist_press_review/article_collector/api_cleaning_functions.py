@@ -7,10 +7,17 @@ The functions are then used by the module guardian_collector.
 import re
 import logging
 import os
+import threading
+import time
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import pandas as pd
-from sqlalchemy.sql import text
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sqlalchemy.sql import table, column, text
+from sqlalchemy.dialects.postgresql import insert
+from postgres_schema import create_article_partitions, drop_article_partitions
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,14 +26,71 @@ logging.basicConfig(
 
 # The Guardian
 GUARDIAN_API_KEY = os.getenv("GUARDIAN_API_KEY")
+# Base URL of the API: can point to a local stand-in server serving recorded responses
+GUARDIAN_API_URL = os.getenv("GUARDIAN_API_URL", "https://content.guardianapis.com")
+
+# HTTP SETTINGS for the API
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "9"))  # sections fetched in parallel
+GUARDIAN_REQUESTS_PER_SECOND = float(os.getenv("GUARDIAN_REQUESTS_PER_SECOND", "1"))
+GUARDIAN_TIMEOUT = float(os.getenv("GUARDIAN_TIMEOUT", "20"))  # seconds
+GUARDIAN_RETRIES = int(os.getenv("GUARDIAN_RETRIES", "5"))  # on 429 and 5xx, with exponential backoff
+GUARDIAN_BACKOFF = float(os.getenv("GUARDIAN_BACKOFF", "2"))  # seconds, doubled at each retry
 
 # RESEARCH PARAMETERS for the API
-PARAMETERS = {
-    "order-by": "newest",
-    "page-size": 20,
-    "show-fields": ["all"],
-    "show-tags": ["keyword"],
-    "api-key": f"{GUARDIAN_API_KEY}"}
+# "projected" only asks for the fields written into postgres and reads the main image from the elements;
+# "full" asks for all the fields and scrapes the main image out of the HTML of the 'main' field.
+GUARDIAN_FETCH_MODE = os.getenv("GUARDIAN_FETCH_MODE", "projected")
+FETCH_MODES = {
+    "full": {
+        "order-by": "newest",
+        "page-size": 20,
+        "show-fields": ["all"],
+        "show-tags": ["keyword"],
+        "api-key": f"{GUARDIAN_API_KEY}"},
+    "projected": {
+        "order-by": "newest",
+        "page-size": 20,
+        "show-fields": "byline,trailText,bodyText,lang,shortUrl",
+        "show-elements": "image",
+        "show-tags": "keyword",
+        "api-key": f"{GUARDIAN_API_KEY}"}}
+PARAMETERS = FETCH_MODES[GUARDIAN_FETCH_MODE]
+
+# Incremental collection: once a section has a watermark, everything published since then
+# is paged through, oldest first, PAGE_SIZE articles per request and MAX_PAGES requests per run at most.
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGES = int(os.getenv("MAX_PAGES", "10"))
+
+# Number of days of articles kept in postgres: older daily partitions of guardian_articles are dropped.
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "7"))
+
+# Keys of an article dictionary and the matching columns of the guardian_articles table
+ARTICLE_COLUMNS = {
+    "date": "date",
+    "section_id": "section_id",
+    "section_name": "section_name",
+    "title": "title",
+    "author": "author",
+    "subtitle": "subtitle",
+    "body": "body",
+    "img_url": "img_url",
+    "img_descr": "img_descr",
+    "img_cred": "img_cred",
+    "language": "language",
+    "url": "url",
+    "short_url": "short_url",
+    "tags": "tags",
+    "marx_comment": "marx_comment",
+    "sentiment_score": "sentiment_score",
+    "judgement": "marx_judgement"}
+
+GUARDIAN_ARTICLES = table("guardian_articles", *[column(name) for name in ARTICLE_COLUMNS.values()])
+# Channel on which the writes into guardian_articles are notified, with the section as payload
+# (an empty payload for all the sections): the webapp listens to it to refresh its cache of the section pages.
+ARTICLES_CHANNEL = "guardian_articles"
+
+# Number of articles written by each multi-row INSERT of store_articles_on_postgres( )
+WRITE_PAGE_SIZE = int(os.getenv("WRITE_PAGE_SIZE", "500"))
 
 
 def extract_img_and_tag(entry_main, entry_tag):
@@ -56,6 +120,43 @@ def extract_img_and_tag(entry_main, entry_tag):
     else:
         img_cred = "NULL"
 
+    return img_url, img_capt, img_cred, extract_tags(entry_tag)
+
+
+def extract_img_from_elements(entry_elements):
+    """
+    Structured alternative to the regex scraping of extract_img_and_tag( ):
+    reads the URL, caption and credit of an article's main image from the elements of the API dictionary
+    and returns them: 3 variables returned ("NULL" when missing).
+    The URL is the one of the widest asset no wider than 1000 pixels, like the <img> of the 'main' field.
+    ------
+    ARGUMENT:
+    The API dictionary entry for the elements of an article ('result->elements'), requested with show-elements=image.
+    """
+    main_images = [el for el in entry_elements if el.get("relation") == "main" and el.get("type") == "image"]
+    if not main_images or not main_images[0].get("assets"):
+        return "NULL", "NULL", "NULL"
+
+    assets = main_images[0]["assets"]
+    fitting = [asset for asset in assets if int(asset.get("typeData", {}).get("width", 0)) <= 1000]
+    asset = max(fitting or assets, key=lambda asset: int(asset.get("typeData", {}).get("width", 0)))
+    type_data = asset.get("typeData", {})
+
+    img_url = asset.get("file") or "NULL"
+    # Markup is dropped from the caption, except the <strong> tags the collector uses to spot unsuitable images
+    img_capt = re.sub(r"<(?!/?strong>)[^>]+>", "", type_data.get("caption", "")).strip() or "NULL"
+    img_cred = type_data.get("credit") or "NULL"
+
+    return img_url, img_capt, img_cred
+
+
+def extract_tags(entry_tag):
+    """
+    Joins the keywords of an article into a single lowercase STRING separated by commas (None if there is none).
+    ------
+    ARGUMENT:
+    The API dictionary entry for the tags of an article ('result->tags')
+    """
     tags = None
     for el in entry_tag:
         if el["type"] == "keyword":
@@ -64,120 +165,405 @@ def extract_img_and_tag(entry_main, entry_tag):
             else:
                 tags = f'{tags},{el["webTitle"].lower()}'
 
-    return img_url, img_capt, img_cred, tags
+    return tags
 
 
-def get_new_articles(section):
+class RateLimiter:
+    """
+    Spaces out the calls to the API, across all the threads sharing it,
+    so that at most `rate` requests start every second (no limit if `rate` is 0).
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the caller is allowed to send its request."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+rate_limiter = RateLimiter(GUARDIAN_REQUESTS_PER_SECOND)
+
+
+def create_guardian_session(pool_size=FETCH_WORKERS):
+    """
+    Creates a requests session for the API of The Guardian,
+    which asks for gzip-compressed responses, keeps up to pool_size connections alive
+    and retries with exponential backoff the requests answered with 429 or 5xx
+    (honouring the Retry-After header when there is one).
+    """
+    retries = Retry(
+        total=GUARDIAN_RETRIES,
+        backoff_factor=GUARDIAN_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip"
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def parse_articles(many_results):
+    """
+    Writes the data of the articles of an API response into separate dictionaries,
+    which are returned into a LIST. Inconsistent articles are skipped.
+    ----------
+    ARGUMENT:
+    The LIST of results of the API response ('response->results').
+    """
+    articles = []
+    for results in many_results:
+
+        try:
+            fields = results["fields"]
+
+            if "main" in fields:
+                img_url, img_capt, img_cred, tags = extract_img_and_tag(fields["main"], results["tags"])
+            else:
+                img_url, img_capt, img_cred = extract_img_from_elements(results.get("elements", []))
+                tags = extract_tags(results["tags"])
+
+            article = {
+                "date": f"{pd.to_datetime(re.sub(r'[T,Z]',' ', results['webPublicationDate']))}",
+                "section_id": f"{results['sectionId']}",
+                "section_name": f"{results['sectionName']}",
+                "title": f"{results['webTitle']}",
+                "author": f"{fields['byline']}",
+                "subtitle": f"{fields['trailText']}",
+                "body": f"{fields['bodyText']}",
+                "img_url": f"{img_url}",
+                "img_descr": f"{img_capt}",
+                "img_cred": f"{img_cred}",
+                "language": f"{fields['lang']}",
+                "url": f"{results['webUrl']}",
+                "short_url": f"{fields['shortUrl']}",
+                "tags": f"{tags}",
+            }
+
+            articles.append(article)
+
+        except:
+            logging.warning(
+                "Inconsistent fields in API response with regard to an article: skipping."
+            )
+
+    return articles
+
+
+def get_new_articles(section, session=None, from_date=None):
     """
     Get new articles on a certain topic via the API of The Guardian
     and writes their data into separate dictionaries,
-    which are returned into a LIST
+    which are returned into a LIST (None if the API could not be reached at all).
+    Without from_date, only the newest page of articles is requested;
+    with it, all the articles published since then are paged through, oldest first.
     ----------
-    ARGUMENT:
-    A STRING linking to the desired SECTION of THE Guardian.
+    ARGUMENTS:
+    1) A STRING linking to the desired SECTION of THE Guardian.
+    2) the requests session to use (see create_guardian_session( )); a new one is created if missing.
+    3) the watermark of the section (a datetime, in UTC), or None.
     """
+    if session is None:
+        session = create_guardian_session()
 
-    guardian_endpoint = f"https://content.guardianapis.com/search?section={section}"
-    resp = requests.get(guardian_endpoint, PARAMETERS)
-    if resp.status_code == 200:
-        logging.info(f"Successfully connected to {guardian_endpoint} : scraping...")
-        respjson = resp.json()
-        many_results = respjson["response"]["results"]
+    guardian_endpoint = f"{GUARDIAN_API_URL}/search?section={section}"
+    parameters = dict(PARAMETERS)
+    if from_date is not None:
+        parameters.update({
+            "from-date": f"{from_date:%Y-%m-%dT%H:%M:%SZ}",
+            "order-by": "oldest",
+            "page-size": PAGE_SIZE})
 
-        articles = []
-        counter = 0
-        for results in many_results:
+    articles = []
+    page = 1
+    while True:
+        parameters["page"] = page
+        rate_limiter.wait()
+        try:
+            resp = session.get(guardian_endpoint, params=parameters, timeout=GUARDIAN_TIMEOUT)
+        except requests.RequestException as error:
+            logging.warning(f"There is a PROBLEM: could not reach {guardian_endpoint} ({error})")
+            return articles if page > 1 else None
 
-            try:
-                fields = results["fields"]
+        if resp.status_code != 200:
+            logging.warning(
+                f"There is a PROBLEM: {guardian_endpoint} has answered with {resp.status_code}")
+            return articles if page > 1 else None
 
-                img_url, img_capt, img_cred, tags = extract_img_and_tag(fields["main"], results["tags"])
+        try:
+            response = resp.json()["response"]
+            results = response["results"]
+        except (ValueError, KeyError, TypeError) as error:
+            logging.warning(
+                f"There is a PROBLEM: {guardian_endpoint} has answered with an unexpected body ({error!r})")
+            return articles if page > 1 else None
 
-                article = {
-                    "date": f"{pd.to_datetime(re.sub(r'[T,Z]',' ', results['webPublicationDate']))}",
-                    "section_id": f"{results['sectionId']}",
-                    "section_name": f"{results['sectionName']}",
-                    "title": f"{results['webTitle']}",
-                    "author": f"{fields['byline']}",
-                    "subtitle": f"{fields['trailText']}",
-                    "body": f"{fields['bodyText']}",
-                    "img_url": f"{img_url}",
-                    "img_descr": f"{img_capt}",
-                    "img_cred": f"{img_cred}",
-                    "language": f"{fields['lang']}",
-                    "url": f"{results['webUrl']}",
-                    "short_url": f"{fields['shortUrl']}",
-                    "tags": f"{tags}",
-                }
-
-                articles.append(article)
-                counter = counter + 1
-
-            except:
-                logging.warning(
-                    "Inconsistent fields in API response with regard to an article: skipping."
-                )
-        logging.info(
-            f"Section {section.upper()}: {counter} article(s) successfully scraped. Now producing Marx's comments about them."
-        )
+        logging.info(f"Successfully connected to {guardian_endpoint} (page {page}) : scraping...")
+        articles.extend(parse_articles(results))
 
-    else:
-        logging.warning(
-            f"There is a PROBLEM: {guardian_endpoint} has answered with {resp.status_code}")
-        articles = []
+        if from_date is None or page >= response.get("pages", 1):
+            break
+        if page >= MAX_PAGES:
+            logging.warning(
+                f"Section {section.upper()}: stopped after {MAX_PAGES} pages, the rest will be collected next time.")
+            break
+        page += 1
+
+    logging.info(
+        f"Section {section.upper()}: {len(articles)} article(s) successfully scraped.")
 
     return articles
 
 
-def store_article_on_postgres(article_data, postrges_connection):
+def get_new_articles_from_sections(sections, session=None, watermarks=None, max_workers=FETCH_WORKERS):
+    """
+    Runs get_new_articles( ) on several sections in parallel threads sharing one session
+    (hence its keep-alive connections) and the rate limit of the API.
+    RETURNS a DICTIONARY mapping each section to its LIST of articles (None if it failed), in the order of the sections.
+    ----------
+    ARGUMENTS:
+    1) a LIST of sections of The Guardian;
+    2) the requests session to use (see create_guardian_session( )); a new one is created if missing;
+    3) a DICTIONARY of section watermarks (see load_section_watermarks( )), if any;
+    4) the maximum number of sections fetched at the same time.
+    """
+    if session is None:
+        session = create_guardian_session(max_workers)
+    if watermarks is None:
+        watermarks = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        many_articles = executor.map(
+            lambda section: get_new_articles(section, session, watermarks.get(section)), sections)
+
+        return dict(zip(sections, many_articles))
+
+
+def is_article_eligible(article):
+    """
+    Tells whether an article collected by get_new_articles( ) can be displayed on the webapp:
+    no HTML in the subtitle or the image caption, a complete main image and a known author.
+    ----
+    ARGUMENT: a dictionary from the list of articles produced by the function get_new_articles( ).
+    """
+    if "<strong>" in article["subtitle"]:
+        return False
+    elif "<strong>" in article["img_descr"]:
+        return False
+    elif article["img_url"] == "NULL":
+        return False
+    elif article["img_descr"] == "NULL":
+        return False
+    elif article["img_cred"] == "NULL":
+        return False
+    elif article["author"] == "":
+        return False
+    return True
+
+
+def select_articles_to_comment(articles, stored_urls):
+    """
+    Pre-generation stage of the collector: keeps only the eligible articles which are not stored yet,
+    so that the gpt2 model only comments on articles that will actually be written into postgres.
+    Also counts how many articles were skipped, and why.
+    RETURNS the LIST of selected articles and a DICTIONARY of counters.
+    ----------
+    ARGUMENTS:
+    1) the list of articles produced by the function get_new_articles( );
+    2) the SET of the short URLs already stored into postgres (see load_stored_short_urls( )).
+    """
+    selected = []
+    selected_urls = set()
+    counters = {"fetched": len(articles), "ineligible": 0, "already_stored": 0, "to_generate": 0}
+
+    for article in articles:
+        if not is_article_eligible(article):
+            counters["ineligible"] += 1
+        elif article["short_url"] in stored_urls or article["short_url"] in selected_urls:
+            counters["already_stored"] += 1
+        else:
+            selected.append(article)
+            selected_urls.add(article["short_url"])
+    counters["to_generate"] = len(selected)
+
+    return selected, counters
+
+
+def insert_articles(articles, postrges_connection):
+    """
+    Writes a list of articles into the PostgreSQL database with one multi-row INSERT,
+    skipping those whose short URL is already stored.
+    RETURNS the LIST of the short URLs actually written.
+    ---------
+    ARGUMENTS:
+    1) a list of article dictionaries, with the marxist comments already added;
+    2) an open connection to postgres.
+    """
+    rows = [{column_name: article[key] for key, column_name in ARTICLE_COLUMNS.items()}
+            for article in articles]
+    statement = (
+        insert(GUARDIAN_ARTICLES)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["short_url", "date"])
+        .returning(GUARDIAN_ARTICLES.c.short_url))
+
+    return [row[0] for row in postrges_connection.execute(statement)]
+
+
+def notify_articles_changed(sections, postrges_connection):
+    """
+    Notifies the listeners of ARTICLES_CHANNEL that the articles of some sections have changed.
+    Inside a transaction, the notifications are only delivered if it commits.
+    ---------
+    ARGUMENTS: an ITERABLE of sections (an empty STRING for all the sections), and a connection to postgres.
+    """
+    for section in sorted(set(sections)):
+        postrges_connection.execute(
+            text("SELECT pg_notify(:channel, :section);"), channel=ARTICLES_CHANNEL, section=section)
+
+
+def store_articles_on_postgres(articles, postrges_engine, page_size=WRITE_PAGE_SIZE):
+    """
+    Writes the articles collected by get_new_articles( ) into the PostgreSQL database in a single transaction,
+    page_size articles per INSERT statement, after creating the daily partitions they need.
+    Each page runs inside a savepoint: if it fails, its articles are written again one by one,
+    so that a faulty article is reported and skipped without dropping the rest of the batch.
+    The sections that received new articles are notified on ARTICLES_CHANNEL when the transaction commits.
+    RETURNS the LIST of the short URLs written and the LIST of (short URL, error) for the articles that failed.
+    ---------
+    ARGUMENTS:
+    1) the list of articles produced by the function get_new_articles( ), with the marxist comments added;
+    2) the postgres engine;
+    3) the number of articles per INSERT statement.
+    """
+    stored = []
+    failed = []
+
+    with postrges_engine.begin() as connection:
+        create_article_partitions({pd.to_datetime(article["date"]).date() for article in articles}, connection)
+        for start in range(0, len(articles), page_size):
+            page = articles[start:start + page_size]
+            try:
+                with connection.begin_nested():
+                    stored.extend(insert_articles(page, connection))
+                continue
+            except Exception as error:
+                logging.warning(f"Bulk write of {len(page)} article(s) failed ({error}): retrying them one by one.")
+
+            for article in page:
+                try:
+                    with connection.begin_nested():
+                        stored.extend(insert_articles([article], connection))
+                except Exception as error:
+                    failed.append((article.get("short_url"), error))
+                    logging.warning(
+                        f"Encountered a problem while attempting to store {article.get('short_url')} into postgres. Skipping.")
+
+        stored_urls = set(stored)
+        notify_articles_changed(
+            [article["section_id"] for article in articles if article["short_url"] in stored_urls], connection)
+
+    logging.info(
+        f"{len(stored)} new article(s) written into postgres, "
+        f"{len(articles) - len(stored) - len(failed)} already there, {len(failed)} failed.")
+
+    return stored, failed
+
+
+def store_article_on_postgres(article_data, postrges_engine):
     """
     Writes an item from the data collected by get_new_articles( ) into the PostgreSQL database.
+    Articles whose short URL is already stored are left untouched.
+    RETURNS True if the article has been written, False otherwise.
     ---------
     ARGUMENTS:
     1) a dictionary from the list of articles produced by the function get_new_articles( ).
-    2) the connected postgres engine
+    2) the postgres engine
     """
+    stored, _ = store_articles_on_postgres([article_data], postrges_engine)
 
-    try:
-        postrges_connection.execute(
-            text("INSERT INTO guardian_articles VALUES (:a,:b,:c,:d,:e,:f,:g,:h,:i,:j,:k,:l,:m,:n,:o,:p,:q);"),
-            a=article_data["date"],
-            b=article_data["section_id"],
-            c=article_data["section_name"],
-            d=article_data["title"],
-            e=article_data["author"],
-            f=article_data["subtitle"],
-            g=article_data["body"],
-            h=article_data["img_url"],
-            i=article_data["img_descr"],
-            j=article_data["img_cred"],
-            k=article_data["language"],
-            l=article_data["url"],
-            m=article_data["short_url"],
-            n=article_data["tags"],
-            o=article_data["marx_comment"],
-            p=article_data["sentiment_score"],
-            q=article_data["judgement"],
-        )
-        logging.info("New article written into postgres.")
-    except:
-        logging.warning(
-            "Encountered a problem while attempting to store an article into postgres. Skipping.")
+    return len(stored) == 1
+
+
+def load_stored_short_urls(postrges_connection):
+    """
+    Reads the short URLs of the articles already stored into the PostgreSQL database
+    and RETURNS them as a SET, to be used as the in-process "already stored" index of the collector.
+    The unique index on (short_url, date) remains the reference: this set only spares useless generations.
+    ARGUMENT: the connected postgres engine.
+    """
+    short_urls = {row[0] for row in postrges_connection.execute("SELECT short_url FROM guardian_articles;")}
+    logging.info(f"{len(short_urls)} stored article URL(s) loaded from postgres.")
+
+    return short_urls
 
 
-def remove_old_articles_from_postgres(postrges_connection):
+def load_section_watermarks(postrges_connection):
     """
-    Removes all the articles older than a week form the the PostgreSQL database.
+    Reads the watermark of each section, i.e. the publication date of the newest article collected for it.
+    RETURNS a DICTIONARY mapping the sections to their watermarks (datetimes, in UTC).
     ARGUMENT: the connected postgres engine.
     """
+    return dict(postrges_connection.execute("SELECT section_id, last_seen FROM section_watermarks;").fetchall())
 
-    today = pd.to_datetime(dt.date.today())
-    a_week_ago = today - pd.Timedelta(days=7)
 
+def save_section_watermark(section, articles, postrges_connection, failed_urls=()):
+    """
+    Moves the watermark of a section forward to the newest publication date among its collected articles.
+    To be called once the articles have been stored, so that a crash never skips any of them.
+    If some articles could not be stored, the watermark stays before the oldest of them,
+    so that they are fetched and retried next time.
+    RETURNS the new watermark, or None if there was no article before the first failure.
+    ----------
+    ARGUMENTS:
+    1) a section of The Guardian;
+    2) the LIST of articles collected for that section by get_new_articles( );
+    3) the connected postgres engine;
+    4) the short URLs of the articles that store_articles_on_postgres( ) could not store, if any.
+    """
+    failed_dates = [pd.to_datetime(article["date"]) for article in articles if article["short_url"] in failed_urls]
+    if failed_dates:
+        articles = [article for article in articles if pd.to_datetime(article["date"]) < min(failed_dates)]
+        logging.warning(
+            f"Section {section.upper()}: {len(failed_dates)} article(s) could not be stored, "
+            f"the watermark stays before {min(failed_dates)} to retry them.")
+    if not articles:
+        return None
+
+    last_seen = max(pd.to_datetime(article["date"]) for article in articles).to_pydatetime()
     postrges_connection.execute(
-        f"""DELETE from guardian_articles
-            WHERE date < '{a_week_ago}'
-            ;
-    """)
+        text("""INSERT INTO section_watermarks VALUES (:section, :last_seen)
+                ON CONFLICT (section_id)
+                DO UPDATE SET last_seen = GREATEST(section_watermarks.last_seen, EXCLUDED.last_seen);"""),
+        section=section,
+        last_seen=last_seen)
+
+    return last_seen
+
+
+def remove_old_articles_from_postgres(postrges_connection, retention_days=RETENTION_DAYS):
+    """
+    Removes the articles older than retention_days days from the PostgreSQL database,
+    by dropping the daily partitions of guardian_articles that hold them.
+    When some partitions have been dropped, all the sections are notified on ARTICLES_CHANNEL.
+    ARGUMENTS: the connected postgres engine, and the number of days of articles to keep.
+    """
+    dropped = drop_article_partitions(dt.date.today() - dt.timedelta(days=retention_days), postrges_connection)
+    if dropped:
+        with postrges_connection.begin() as connection:
+            notify_articles_changed([""], connection)
 
-    logging.info("Records older than a week erased from postgres.")
+    logging.info(f"Records older than {retention_days} days erased from postgres ({len(dropped)} daily partition(s) dropped).")
@@ -0,0 +1,44 @@
+"""
+This module compares the two fetch modes of the API of The Guardian (see GUARDIAN_FETCH_MODE):
+for one page of each section, it prints the bytes transferred, the bytes once decompressed
+and the time spent parsing the response into article dictionaries.
+Run it with a valid GUARDIAN_API_KEY: python benchmark_guardian_payload.py
+"""
+
+import gzip
+import json
+import time
+from api_cleaning_functions import FETCH_MODES, GUARDIAN_API_URL, create_guardian_session, parse_articles
+
+# Same sections as the collector (importing guardian_collector would load the gpt2 model)
+SECTIONS = ["sport", "world", "politics", "environment", "global-development",
+            "money", "education", "business", "culture"]
+
+
+def measure_section(section, parameters, session):
+    """
+    Fetches one page of a section with the given research parameters.
+    RETURNS the bytes transferred, the decompressed bytes, the parsing time (seconds) and the number of articles.
+    """
+    resp = session.get(f"{GUARDIAN_API_URL}/search?section={section}", params=parameters, stream=True)
+    resp.raise_for_status()
+    transferred = resp.raw.read(decode_content=False)
+    payload = gzip.decompress(transferred) if resp.headers.get("Content-Encoding") == "gzip" else transferred
+
+    start = time.perf_counter()
+    articles = parse_articles(json.loads(payload)["response"]["results"])
+    parse_time = time.perf_counter() - start
+
+    return len(transferred), len(payload), parse_time, len(articles)
+
+
+if __name__ == "__main__":
+
+    session = create_guardian_session()
+    print(f"{'mode':<10}{'transferred (kB)':>18}{'decompressed (kB)':>19}{'parse (ms)':>12}{'articles':>10}")
+    for mode, parameters in FETCH_MODES.items():
+        totals = [0, 0, 0.0, 0]
+        for section in SECTIONS:
+            for i, value in enumerate(measure_section(section, parameters, session)):
+                totals[i] += value
+        print(f"{mode:<10}{totals[0] / 1000:>18.1f}{totals[1] / 1000:>19.1f}{totals[2] * 1000:>12.1f}{totals[3]:>10}")
@@ -0,0 +1,151 @@
+"""
+This module checks the incremental collection of get_new_articles( ) against a local stand-in of the API of The Guardian,
+serving synthetic articles (one per hour) with its paging and date filter, and failing on purpose for some sections:
+1) without a watermark, only the newest page of a section is requested;
+2) with a watermark, the articles published since then are paged through, oldest first,
+and the paging stops at the last page, or after MAX_PAGES pages;
+3) a request answered with 503 is retried, and the section is still collected;
+4) a section the API never answers for gives None; a failure after the first page keeps the pages already read;
+5) an answer that is not the expected JSON (not JSON at all, or without "response") is handled like a failure.
+No network access nor API key is needed: python check_guardian_paging.py
+"""
+
+import os
+
+# The stand-in server is local: no rate limit, and no backoff between the retries
+os.environ["GUARDIAN_REQUESTS_PER_SECOND"] = "0"
+os.environ["GUARDIAN_BACKOFF"] = "0"
+os.environ["GUARDIAN_RETRIES"] = "2"
+os.environ["PAGE_SIZE"] = "10"
+
+import json
+import sys
+import threading
+import datetime as dt
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import api_cleaning_functions
+from api_cleaning_functions import create_guardian_session, get_new_articles, MAX_PAGES, PAGE_SIZE
+
+ARTICLES = 200  # per section, one every hour
+FIRST_DATE = dt.datetime(2021, 6, 1)
+
+requests_received = Counter()  # (section, page) -> number of requests
+
+
+def synthetic_article(section, n):
+    """RETURNS the API result of the n-th synthetic article of a section."""
+    return {
+        "webPublicationDate": f"{FIRST_DATE + dt.timedelta(hours=n):%Y-%m-%dT%H:%M:%SZ}",
+        "sectionId": section,
+        "sectionName": section.capitalize(),
+        "webTitle": f"Article {n}",
+        "webUrl": f"https://www.theguardian.com/{section}/{n}",
+        "fields": {"byline": "Reporter", "trailText": f"Trail text {n}", "bodyText": "Body.",
+                   "lang": "en", "shortUrl": f"https://gu.com/p/{section}-{n}"},
+        "tags": [{"type": "keyword", "webTitle": "Check"}],
+        "elements": []}
+
+
+class StandInAPI(BaseHTTPRequestHandler):
+    """
+    Answers /search like the API: from-date, order-by, page-size and page are honoured.
+    Section "flaky" fails once with 503 per page, "down" always fails with 500,
+    and "broken" fails with 500 from the second page on.
+    Section "garbled" answers with a body that is not JSON, and "truncated" with a JSON body
+    without "response" from the second page on, both with status 200.
+    """
+
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        section, page = query["section"], int(query.get("page", 1))
+        requests_received[section, page] += 1
+
+        if (section == "down" or (section == "broken" and page > 1)
+                or (section == "flaky" and requests_received[section, page] == 1)):
+            self.send_response(503 if section == "flaky" else 500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if section == "garbled" or (section == "truncated" and page > 1):
+            body = b"<html>Bad gateway</html>" if section == "garbled" else json.dumps({"message": "error"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        results = [synthetic_article(section, n) for n in range(ARTICLES)]
+        if "from-date" in query:
+            results = [result for result in results if result["webPublicationDate"] >= query["from-date"]]
+        if query.get("order-by") != "oldest":
+            results.reverse()
+        page_size = int(query.get("page-size", 20))
+        pages = max(1, -(-len(results) // page_size))
+        body = json.dumps({"response": {
+            "status": "ok", "pages": pages, "currentPage": page,
+            "results": results[(page - 1) * page_size:page * page_size]}}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def check(condition, message):
+    """Prints the result of a check, and exits with an error if it has failed."""
+    print(f"{'OK' if condition else 'FAILED'}: {message}")
+    if not condition:
+        sys.exit(1)
+
+
+def pages_requested(section):
+    """RETURNS the sorted LIST of the pages requested for a section."""
+    return sorted(page for requested_section, page in requests_received if requested_section == section)
+
+
+if __name__ == "__main__":
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_cleaning_functions.GUARDIAN_API_URL = f"http://127.0.0.1:{server.server_port}"
+    session = create_guardian_session()
+
+    articles = get_new_articles("newest", session)
+    check(pages_requested("newest") == [1] and len(articles) == 20
+          and articles[0]["title"] == f"Article {ARTICLES - 1}",
+          "without a watermark, only the newest page is requested")
+
+    watermark = FIRST_DATE + dt.timedelta(hours=ARTICLES - 25)
+    articles = get_new_articles("recent", session, watermark)
+    check([article["title"] for article in articles] == [f"Article {n}" for n in range(ARTICLES - 25, ARTICLES)],
+          "with a watermark, the articles published since then are collected, oldest first")
+    check(pages_requested("recent") == [1, 2, 3], "the paging stops at the last page")
+
+    articles = get_new_articles("backlog", session, FIRST_DATE)
+    check(pages_requested("backlog") == list(range(1, MAX_PAGES + 1)) and len(articles) == MAX_PAGES * PAGE_SIZE
+          and articles[-1]["title"] == f"Article {MAX_PAGES * PAGE_SIZE - 1}",
+          f"a long backlog stops after MAX_PAGES ({MAX_PAGES}) pages, the rest being left for the next run")
+
+    articles = get_new_articles("flaky", session, watermark)
+    check(len(articles) == 25 and requests_received["flaky", 1] == 2, "a request answered with 503 is retried")
+
+    check(get_new_articles("down", session, watermark) is None, "a section the API never answers for gives None")
+
+    articles = get_new_articles("broken", session, watermark)
+    check(articles is not None and len(articles) == PAGE_SIZE,
+          "a failure after the first page keeps the articles of the pages already read")
+
+    check(get_new_articles("garbled", session, watermark) is None, "an answer that is not JSON gives None")
+
+    articles = get_new_articles("truncated", session, watermark)
+    check(articles is not None and len(articles) == PAGE_SIZE and pages_requested("truncated") == [1, 2],
+          "an answer without \"response\" after the first page keeps the articles of the pages already read")
+
+    server.shutdown()
@@ -1,14 +1,22 @@
 """
 This module uses the API of The Guardian to collect the metadata of the most recent articles on various topics,
-and stores them into an SQL database. Data older than a week are automatically erased from the database.
+and stores them into an SQL database. Data older than RETENTION_DAYS days (a week by default) are automatically erased
+from the database, one daily partition at a time.
+Each section is refreshed at its own pace by the scheduler of the module scheduler.
 """
 
 import logging
 import os
-from time import sleep
+from collections import Counter
+from time import sleep, monotonic
 from sqlalchemy import create_engine
-from api_cleaning_functions import get_new_articles, store_article_on_postgres, remove_old_articles_from_postgres
-from marxist_text_generator import have_marx_comment_on_article, analyser_of_the_marxist_sentiment
+from api_cleaning_functions import (
+    create_guardian_session, get_new_articles_from_sections, select_articles_to_comment, store_articles_on_postgres,
+    load_stored_short_urls, load_section_watermarks, save_section_watermark, remove_old_articles_from_postgres)
+from postgres_schema import prepare_database
+from marxist_text_generator import (
+    marx_impressions_on_articles, start_generation_workers, GENERATION_BATCH_SIZE, GENERATION_PROCESSES)
+from scheduler import SectionScheduler
 
 
 logging.basicConfig(
@@ -36,9 +44,54 @@ SECTIONS = [
     "business",
     "culture"] 
 
+# Articles are commented on and stored CHECKPOINT_SIZE at a time,
+# so that a crash in the middle of a section only loses the current chunk.
+# By default a checkpoint gives at least one batch to each generation process.
+CHECKPOINT_SIZE = int(os.getenv("CHECKPOINT_SIZE", f"{max(2, GENERATION_PROCESSES) * GENERATION_BATCH_SIZE}"))
+RETENTION_INTERVAL = 60 * 60 * 24  # seconds between two clean-ups of old articles
+
+
+def process_section(section, articles, stored_urls, postrges_engine):
+    """
+    Has Marx comment on the new eligible articles of a section and stores them into postgres,
+    one checkpoint of CHECKPOINT_SIZE articles at a time, then moves the watermark of the section forward
+    (up to the first article that could not be stored, see save_section_watermark( )).
+    RETURNS the DICTIONARY of counters of select_articles_to_comment( ),
+    plus the number of articles stored and of those that could not be stored.
+    ----------
+    ARGUMENTS:
+    1) a section of The Guardian;
+    2) the LIST of articles collected for that section by get_new_articles( );
+    3) the SET of the short URLs already stored into postgres, updated with the new ones;
+    4) the postgres engine.
+    """
+    new_articles, counters = select_articles_to_comment(articles, stored_urls)
+    logging.info(
+        f"Section {section.upper()}: {counters['to_generate']} new article(s) for Marx to comment on; "
+        f"skipped {counters['ineligible']} ineligible and {counters['already_stored']} already stored.")
+
+    counters["stored"] = 0
+    failed_urls = set()
+    for start in range(0, len(new_articles), CHECKPOINT_SIZE):
+        chunk = new_articles[start:start + CHECKPOINT_SIZE]
+        marx_impressions = marx_impressions_on_articles([article["subtitle"] for article in chunk])
+        for article, impressions in zip(chunk, marx_impressions):
+            article.update(impressions)
+        stored, failed = store_articles_on_postgres(chunk, postrges_engine)
+        stored_urls.update(stored)
+        counters["stored"] += len(stored)
+        failed_urls.update(short_url for short_url, _ in failed)
+    counters["failed"] = len(failed_urls)
+
+    save_section_watermark(section, articles, postrges_engine, failed_urls)
+
+    return counters
+
 
 if __name__ == "__main__":
 
+    # the generation processes are forked first, so that they inherit no pooled connection to postgres
+    start_generation_workers()
     pg = create_engine(f"postgresql://{POSTGRES_USER}:{POSTGRES_PSW}@{HOST}:{PORT}/{DATABASE_NAME}")
     try:
         pg.connect() 
@@ -49,68 +102,41 @@ if __name__ == "__main__":
         )
         exit()
 
-    pg.execute(
-        """
-        CREATE TABLE IF NOT EXISTS guardian_articles (
-        date TIMESTAMP,
-        section_id VARCHAR(200),
-        section_name VARCHAR(200),
-        title VARCHAR(500),
-        author VARCHAR(500),
-        subtitle VARCHAR(1000),
-        body VARCHAR(200000),
-        img_url VARCHAR(1000),
-        img_descr VARCHAR(1000),
-        img_cred VARCHAR(1000),
-        language VARCHAR(10),
-        url VARCHAR(1000),
-        short_url VARCHAR(400),
-        tags VARCHAR(1000),
-        marx_comment VARCHAR(1100),
-        sentiment_score NUMERIC,
-        marx_judgement VARCHAR(200)      
-        );
-    """)
+    prepare_database(pg)
+    session = create_guardian_session()
+
+    scheduler = SectionScheduler(SECTIONS, pg)
+    last_retention = None
 
     while True:
-        remove_old_articles_from_postgres(pg)
-        control = [] 
-        condition = True
-        counter = 0
-        logging.info("control list cleaned up.")
-
-        while condition:
-            if counter == 7:
-                condition = False
-
-            for section in SECTIONS:
-
-                new_articles = get_new_articles(section)
-                for article in new_articles:
-                    marx_impressions = analyser_of_the_marxist_sentiment(
-                        have_marx_comment_on_article(article["subtitle"])
-                    )
-                    article.update(marx_impressions)
-
-                for article in new_articles:
-                    if "<strong>" in article["subtitle"]:
-                        continue
-                    elif "<strong>" in article["img_descr"]:
-                        continue
-                    elif article["img_url"] == "NULL":
-                        continue
-                    elif article["img_descr"] == "NULL":
-                        continue
-                    elif article["img_cred"] == "NULL":
-                        continue
-                    elif article["author"] == "":
-                        continue
-                    elif article["title"] not in control:
-                        store_article_on_postgres(article, pg)  # does not work.
-                        control.append(article["title"])
-                    else:
-                        logging.info("Article already in postgres: skipping.")
-
-            sleep(60 * 60 * 23.5)  # the whole process with 9 sections takes more or less 30 mins
-            counter += 1
-            
\ No newline at end of file
+        if last_retention is None or monotonic() - last_retention > RETENTION_INTERVAL:
+            remove_old_articles_from_postgres(pg)
+            stored_urls = load_stored_short_urls(pg)  # forgets the articles that have just been dropped
+            last_retention = monotonic()
+
+        due_sections = scheduler.due_sections()
+        if not due_sections:
+            sleep(min(scheduler.seconds_until_next_run(), RETENTION_INTERVAL))
+            continue
+
+        watermarks = load_section_watermarks(pg)
+        fetched_articles = get_new_articles_from_sections(due_sections, session, watermarks)
+        cycle_counters = Counter()
+        failed_sections = 0
+        for section in due_sections:
+            if fetched_articles[section] is None:
+                scheduler.mark_failure(section)
+                failed_sections += 1
+                continue
+            try:
+                cycle_counters.update(process_section(section, fetched_articles[section], stored_urls, pg))
+            except Exception:
+                logging.exception(f"Section {section.upper()} could not be processed.")
+                scheduler.mark_failure(section)
+                failed_sections += 1
+            else:
+                scheduler.mark_success(section)
+        logging.info(
+            f"Cycle over {len(due_sections)} section(s): {cycle_counters['fetched']} article(s) fetched, "
+            f"{cycle_counters['to_generate']} new, {cycle_counters['stored']} stored, "
+            f"{cycle_counters['failed']} failed to be stored; {failed_sections} section(s) failed.")
@@ -2,45 +2,49 @@
 This module contains the functions to:
 1) generate marxist comments based on the trailing test of newspaper articles.
 2) run some basic sentiment analysis on them, just for the fun of doing it. 
+Without an inference server, the batches of prompts can be spread over a pool of worker processes
+(see GENERATION_PROCESSES), so that the generation uses more than one core.
 The functions are then used by the module guardian_collector.
 """
 
-import re
-from aitextgen import aitextgen
+import os
 import logging
+import multiprocessing
+from functools import partial
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from marx_generation import INFERENCE_SERVER_URL, STOP_AT_SENTENCE, generate_candidates, get_model
+from text_cleanup import extract_first_sentence
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s: %(levelname)s: %(message)s")
 
 
-ai = aitextgen(model_folder="trained_model")
 s = SentimentIntensityAnalyzer()
 
+# Number of prompts sampled together in one padded forward pass by the batched generation mode.
+GENERATION_BATCH_SIZE = int(os.getenv("GENERATION_BATCH_SIZE", "8"))
+# Number of texts sampled per prompt: the first one holding a complete sentence becomes the comment.
+GENERATION_CANDIDATES = int(os.getenv("GENERATION_CANDIDATES", "3"))
+# Number of worker processes generating batches of prompts side by side with the local model (1: no pool).
+GENERATION_PROCESSES = int(os.getenv("GENERATION_PROCESSES", "1"))
+# Number of intra-op threads of torch in each process generating texts (0: the default of torch).
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))
 
-NO_TRUNC_INITIAL_SENTENCE_PATTERN = r"^[A-Z][a-z]+.+\."
-REGEX = {
-    r"\n": " ",
-    r"\\'": "’",
-    r"\[.+?\]": "",
-    r"\[.+?\.": ".",
-    r"  [0-9]+.": "",
-    r"\(\?\)": "",
-    r"\([0-9]{1,2}\)": "",
-    r"[<>]": "",
-    r"\.+": ".",
-    r" \. ": ". ",
-    r"\|\|[A-Z]+\|": "",
-    r"(\.)[A-Za-z0-9]+": ". ",
-    r" {2,}": " ",
-    r'''(.\")[A-Za-z0-9]''':'. "'
-}
-
-
-def have_marx_comment_on_article(prompt):
-    """Reworks the trailing text of an article
-    and uses it as a prompt to generate a marxist short text.
+_pool = None
+
+SAMPLING_PARAMETERS = {
+    "min_length": 15,
+    "max_length": 70,
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "repetition_penalty": 1.1,
+    "no_repeat_ngram_size": 2,
+    "stop_at_sentence": STOP_AT_SENTENCE}
+
+
+def truncate_prompt(prompt):
+    """Capitalises the trailing text of an article and keeps its first 10 words at most.
     ----
     ARGUMENT: the trailing text of an article.
     """
@@ -54,28 +58,107 @@ def have_marx_comment_on_article(prompt):
         for word in prompt_words[1:]:
             truncated_prompt += f" {word}"
 
-    marx_statement = ai.generate_one(
-        prompt=truncated_prompt,
-        min_length=15,
-        max_length=70,
-        temperature=0.7,
-        top_p=0.9,
-        repetition_penalty=1.1,
-        no_repeat_ngram_size=2)
-
-    for key, index in REGEX.items():
-        sentence = re.sub(key, index, marx_statement)
-
-    marx_statement_clean = re.findall(NO_TRUNC_INITIAL_SENTENCE_PATTERN, sentence)
-    if len(marx_statement_clean) == 0:
-        marx_comment = "Karl Marx has nothing to say about this."  # can be improved
-        logging.warning(
-            "The gpt2 model could not produce a meaningful text for an article.")
-        return marx_comment
-    else:
-        marx_comment = marx_statement_clean[0]
-        logging.info("The gpt2 has produced a marxist comment on an article!")
-        return marx_comment
+    return truncated_prompt
+
+
+def extract_marx_comment(marx_statements):
+    """Cleans the candidate texts produced by the gpt2 model for an article
+    and keeps the first complete sentence of the first candidate that has one,
+    or returns the placeholder comment if none has.
+    ----
+    ARGUMENT: the LIST of raw texts generated by the gpt2 model for an article.
+    """
+    for marx_statement in marx_statements:
+        marx_comment = extract_first_sentence(marx_statement)
+        if marx_comment is not None:
+            logging.info("The gpt2 has produced a marxist comment on an article!")
+            return marx_comment
+
+    marx_comment = "Karl Marx has nothing to say about this."  # can be improved
+    logging.warning(
+        f"The gpt2 model could not produce a meaningful text for an article in {len(marx_statements)} attempt(s).")
+    return marx_comment
+
+
+def have_marx_comment_on_article(prompt, candidates=GENERATION_CANDIDATES):
+    """Reworks the trailing text of an article
+    and uses it as a prompt to generate a marxist short text.
+    ----
+    ARGUMENTS: the trailing text of an article, and the number of candidate texts sampled for it.
+    """
+    marx_statements = generate_candidates([truncate_prompt(prompt)], candidates, 1, **SAMPLING_PARAMETERS)[0]
+
+    return extract_marx_comment(marx_statements)
+
+
+def init_generation_worker(torch_threads):
+    """Prepares a worker process of the generation pool: sets its number of torch threads,
+    and reseeds it so that the workers do not all sample with the random state inherited from the collector."""
+    import torch
+
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    torch.seed()
+
+
+def start_generation_workers(processes=GENERATION_PROCESSES, torch_threads=TORCH_THREADS):
+    """Starts the pool of worker processes used by have_marx_comment_on_articles( ), when the texts are generated
+    with the local model by more than one process. The model is loaded before the workers are forked,
+    so that they share its weights copy-on-write instead of loading a copy each.
+    To be called at start-up, before the collector starts any thread or opens any connection to postgres,
+    and before the model has run.
+    RETURNS the pool, or None if the comments are generated by the collector process itself.
+    ----
+    ARGUMENTS: the number of worker processes, and the number of torch threads per process.
+    """
+    global _pool
+    if INFERENCE_SERVER_URL:
+        return None
+    import torch  # only needed with the local model
+
+    if processes <= 1:
+        if torch_threads:
+            torch.set_num_threads(torch_threads)
+        return None
+
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")  # the workers already run side by side
+    get_model()
+    _pool = multiprocessing.get_context("fork").Pool(
+        processes, initializer=init_generation_worker, initargs=(torch_threads,))
+    logging.info(f"Started {processes} generation processes with {torch_threads or 'the default'} torch thread(s) each.")
+
+    return _pool
+
+
+def have_marx_comment_on_batch(truncated_prompts, batch_size=GENERATION_BATCH_SIZE, candidates=GENERATION_CANDIDATES):
+    """Generates the candidate texts for a batch of truncated prompts in one forward pass
+    and RETURNS the LIST of the marxist comments extracted from them, in the order of the prompts."""
+    many_statements = generate_candidates(truncated_prompts, candidates, batch_size, **SAMPLING_PARAMETERS)
+
+    return [extract_marx_comment(statements) for statements in many_statements]
+
+
+def have_marx_comment_on_articles(prompts, batch_size=GENERATION_BATCH_SIZE, candidates=GENERATION_CANDIDATES):
+    """Batched version of have_marx_comment_on_article( ):
+    generates one marxist comment per trailing text, batch_size prompts at a time.
+    If start_generation_workers( ) has started a pool, the batches are generated side by side by its processes.
+    RETURNS a LIST of comments in the same order as the prompts.
+    ----
+    ARGUMENTS:
+    1) a LIST of trailing texts of articles (e.g. a whole section, or a whole collection cycle);
+    2) the number of prompts sampled together in one forward pass;
+    3) the number of candidate texts sampled per prompt.
+    """
+    truncated_prompts = [truncate_prompt(prompt) for prompt in prompts]
+    batches = [truncated_prompts[start:start + batch_size] for start in range(0, len(truncated_prompts), batch_size)]
+    comment_on_batch = partial(have_marx_comment_on_batch, batch_size=batch_size, candidates=candidates)
+
+    marx_comments = []
+    for batch_comments in (_pool.imap(comment_on_batch, batches) if _pool else map(comment_on_batch, batches)):
+        marx_comments.extend(batch_comments)
+        logging.info(f"Generated {len(marx_comments)}/{len(truncated_prompts)} marxist comments.")
+
+    return marx_comments
 
 
 def analyser_of_the_marxist_sentiment(comment):
@@ -109,3 +192,16 @@ def analyser_of_the_marxist_sentiment(comment):
             comment_and_analyis["judgement"] = "😶     Karl Marx does not seem particularly interested."
 
     return comment_and_analyis
+
+
+def marx_impressions_on_articles(prompts, batch_size=GENERATION_BATCH_SIZE):
+    """
+    Runs have_marx_comment_on_articles( ) and analyser_of_the_marxist_sentiment( ) on a list of trailing texts.
+    RETURNS a LIST of dictionaries (marx_comment, sentiment_score, judgement), one per prompt, in order.
+    ----
+    ARGUMENTS:
+    1) a LIST of trailing texts of articles;
+    2) the number of prompts sampled together in one forward pass.
+    """
+    return [analyser_of_the_marxist_sentiment(comment)
+            for comment in have_marx_comment_on_articles(prompts, batch_size)]
@@ -0,0 +1,249 @@
+"""
+This module contains the functions that prepare the PostgreSQL database for the article collector.
+The schema evolves through numbered migrations (see MIGRATIONS): each one runs once, in its own transaction,
+and is recorded in the schema_migrations table, so that the collector can apply the missing ones at every start.
+The guardian_articles table is partitioned by publication day: the module also creates the partitions
+before the articles are written, and drops those older than the retention window.
+"""
+
+import logging
+import datetime as dt
+from sqlalchemy.sql import text
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+def create_tables(postrges_connection):
+    """
+    Migration 1. Creates the guardian_articles table if it does not exist yet,
+    the unique index on short_url that the collector relies upon to deduplicate articles,
+    the section_watermarks table that keeps track of the newest article collected per section,
+    and the section_schedule table where the scheduler checkpoints the next refresh of each section.
+    Duplicates stored by previous versions of the collector are removed before the index is built.
+    The statements are idempotent, as the databases created before the migrations already hold some of them.
+    ARGUMENT: a connection to postgres.
+    """
+    postrges_connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS guardian_articles (
+        date TIMESTAMP,
+        section_id VARCHAR(200),
+        section_name VARCHAR(200),
+        title VARCHAR(500),
+        author VARCHAR(500),
+        subtitle VARCHAR(1000),
+        body VARCHAR(200000),
+        img_url VARCHAR(1000),
+        img_descr VARCHAR(1000),
+        img_cred VARCHAR(1000),
+        language VARCHAR(10),
+        url VARCHAR(1000),
+        short_url VARCHAR(400),
+        tags VARCHAR(1000),
+        marx_comment VARCHAR(1100),
+        sentiment_score NUMERIC,
+        marx_judgement VARCHAR(200)
+        );
+    """)
+
+    duplicates = postrges_connection.execute(
+        """DELETE FROM guardian_articles AS newer
+            USING guardian_articles AS older
+            WHERE newer.short_url = older.short_url
+            AND newer.ctid > older.ctid
+            ;
+    """)
+    if duplicates.rowcount:
+        logging.info(f"{duplicates.rowcount} duplicated article(s) removed from postgres.")
+
+    postrges_connection.execute(
+        """CREATE UNIQUE INDEX IF NOT EXISTS guardian_articles_short_url_key
+            ON guardian_articles (short_url)
+            ;
+    """)
+
+    postrges_connection.execute(
+        """CREATE TABLE IF NOT EXISTS section_watermarks (
+            section_id VARCHAR(200) PRIMARY KEY,
+            last_seen TIMESTAMP
+            );
+    """)
+
+    postrges_connection.execute(
+        """CREATE TABLE IF NOT EXISTS section_schedule (
+            section_id VARCHAR(200) PRIMARY KEY,
+            next_run TIMESTAMP,
+            failures INTEGER
+            );
+    """)
+
+
+def index_sections_by_date(postrges_connection):
+    """
+    Migration 2. Indexes the articles by section and from the newest, the order in which the section pages
+    of the webapp read them, so that a page reads its five articles from the index instead of sorting the section.
+    ARGUMENT: a connection to postgres.
+    """
+    postrges_connection.execute(
+        """CREATE INDEX IF NOT EXISTS guardian_articles_section_date_idx
+            ON guardian_articles (section_id, date DESC)
+            ;
+    """)
+    postrges_connection.execute("ANALYZE guardian_articles;")
+
+
+def article_partition_name(day):
+    """RETURNS the name of the partition of guardian_articles holding the articles published on a day (a date)."""
+    return f"guardian_articles_p{day:%Y%m%d}"
+
+
+def list_article_partitions(postrges_connection):
+    """RETURNS the DICTIONARY of the partitions of guardian_articles: publication day -> partition name."""
+    rows = postrges_connection.execute(
+        """SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = 'guardian_articles'
+            ;
+    """)
+
+    return {dt.datetime.strptime(row[0][-8:], "%Y%m%d").date(): row[0] for row in rows}
+
+
+def create_article_partitions(days, postrges_connection):
+    """
+    Creates the partitions of guardian_articles that are missing for some publication days.
+    RETURNS the LIST of the days whose partition has been created.
+    ---------
+    ARGUMENTS: an ITERABLE of days (dates), and a connection to postgres.
+    """
+    missing = sorted(set(days) - set(list_article_partitions(postrges_connection)))
+    for day in missing:
+        postrges_connection.execute(
+            f"""CREATE TABLE IF NOT EXISTS {article_partition_name(day)}
+                PARTITION OF guardian_articles
+                FOR VALUES FROM ('{day}') TO ('{day + dt.timedelta(days=1)}')
+                ;
+        """)
+    if missing:
+        logging.info(f"Created the partition(s) of guardian_articles for {', '.join(map(str, missing))}.")
+
+    return missing
+
+
+def drop_article_partitions(before, postrges_engine):
+    """
+    Drops the partitions of guardian_articles holding the articles published before a day:
+    the old articles go at once with their partition, instead of being deleted row by row.
+    Dropping a partition locks the whole guardian_articles table, which would hold up the section pages of the webapp:
+    on PostgreSQL 14 or later, each partition is first detached CONCURRENTLY, which lets them read the table meanwhile,
+    and then dropped on its own. Both statements run outside of any transaction, hence the engine as argument.
+    A detachment left pending by an interrupted run is finalized, and a partition already detached is dropped.
+    RETURNS the LIST of the days whose partition has been dropped.
+    ---------
+    ARGUMENTS: the first publication day (a date) to keep, and the postgres engine.
+    """
+    with postrges_engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        attached = list_article_partitions(connection)
+        detached = {dt.datetime.strptime(row[0][-8:], "%Y%m%d").date() for row in connection.execute(
+            """SELECT relname FROM pg_class
+                WHERE relname ~ '^guardian_articles_p[0-9]{8}$' AND relkind = 'r' AND NOT relispartition
+                ;
+        """)}
+        expired = sorted(day for day in set(attached) | detached if day < before)
+        concurrently = connection.dialect.server_version_info >= (14,)
+        pending = set()
+        if concurrently and expired:
+            pending = {row[0] for row in connection.execute(
+                """SELECT child.relname
+                    FROM pg_inherits
+                    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                    WHERE pg_inherits.inhdetachpending
+                    ;
+            """)}
+        for day in expired:
+            partition = article_partition_name(day)
+            if concurrently and day in attached:
+                connection.execute(
+                    f"ALTER TABLE guardian_articles DETACH PARTITION {partition} "
+                    f"{'FINALIZE' if partition in pending else 'CONCURRENTLY'};")
+            connection.execute(f"DROP TABLE {partition};")
+
+    return expired
+
+
+def partition_articles_by_day(postrges_connection):
+    """
+    Migration 3. Turns guardian_articles into a table partitioned by publication day, with one partition per day
+    (see create_article_partitions( )), so that the retention drops whole partitions instead of deleting rows.
+    The articles of the former table are moved into the partitions. The unique index, which must hold
+    the partitioning column, becomes (short_url, date): an article keeps the same publication date.
+    The articles without a date cannot be routed to a partition and are dropped.
+    ARGUMENT: a connection to postgres.
+    """
+    postrges_connection.execute(
+        """ALTER TABLE guardian_articles RENAME TO guardian_articles_legacy;
+            ALTER INDEX guardian_articles_short_url_key RENAME TO guardian_articles_legacy_short_url_key;
+            ALTER INDEX guardian_articles_section_date_idx RENAME TO guardian_articles_legacy_section_date_idx;
+            CREATE TABLE guardian_articles (LIKE guardian_articles_legacy INCLUDING DEFAULTS)
+                PARTITION BY RANGE (date);
+            CREATE UNIQUE INDEX guardian_articles_short_url_key ON guardian_articles (short_url, date);
+            CREATE INDEX guardian_articles_section_date_idx ON guardian_articles (section_id, date DESC);
+    """)
+
+    days = [row[0] for row in postrges_connection.execute(
+        "SELECT DISTINCT date::date FROM guardian_articles_legacy WHERE date IS NOT NULL;")]
+    create_article_partitions(days, postrges_connection)
+
+    moved = postrges_connection.execute(
+        "INSERT INTO guardian_articles SELECT * FROM guardian_articles_legacy WHERE date IS NOT NULL;")
+    undated = postrges_connection.execute("SELECT count(*) FROM guardian_articles_legacy WHERE date IS NULL;").scalar()
+    postrges_connection.execute("DROP TABLE guardian_articles_legacy;")
+    postrges_connection.execute("ANALYZE guardian_articles;")
+    logging.info(
+        f"{moved.rowcount} article(s) moved into {len(days)} daily partition(s); {undated} without a date dropped.")
+
+
+# Version, description and function of each migration, in the order in which they apply.
+# A migration must never change once released: changes to the schema go into a new migration.
+MIGRATIONS = [
+    (1, "create the tables of the collector", create_tables),
+    (2, "index the articles by section and date", index_sections_by_date),
+    (3, "partition the articles by publication day", partition_articles_by_day)]
+
+
+def prepare_database(postrges_connection):
+    """
+    Applies to the database the migrations of MIGRATIONS that it has not received yet,
+    each one in its own transaction together with its record in the schema_migrations table.
+    RETURNS the LIST of the versions applied.
+    ARGUMENT: the connected postgres engine.
+    """
+    postrges_connection.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(200),
+            applied_at TIMESTAMP DEFAULT now()
+            );
+    """)
+    applied = {row[0] for row in postrges_connection.execute("SELECT version FROM schema_migrations;")}
+
+    newly_applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        with postrges_connection.begin() as connection:
+            migrate(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description);"),
+                version=version, description=description)
+        logging.info(f"Migration {version} applied to postgres: {description}.")
+        newly_applied.append(version)
+
+    logging.info(f"The postgres schema is at version {max(version for version, _, _ in MIGRATIONS)}.")
+
+    return newly_applied
@@ -0,0 +1,116 @@
+"""
+This module contains the scheduler of the article collector:
+each section of The Guardian is refreshed at its own interval (with some jitter, so that sections drift apart),
+failed sections go into a retry queue with exponential backoff,
+and the schedule is checkpointed into postgres so that a restart resumes where the collector left off.
+The scheduler is used by the module guardian_collector.
+"""
+
+import logging
+import os
+import random
+import datetime as dt
+from sqlalchemy.sql import text
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+# Refresh interval of each section, in minutes: busy sections are refreshed more often than quiet ones.
+# Can be overridden with e.g. SECTION_REFRESH_MINUTES="world=30,culture=720"
+SECTION_REFRESH_MINUTES = {
+    "world": 60,
+    "politics": 60,
+    "business": 180,
+    "sport": 180,
+    "environment": 360,
+    "money": 360,
+    "culture": 360,
+    "education": 720,
+    "global-development": 720}
+DEFAULT_REFRESH_MINUTES = 360
+JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))  # fraction of the interval
+RETRY_MINUTES = float(os.getenv("SCHEDULER_RETRY_MINUTES", "5"))  # first retry delay, doubled at each failure
+
+
+def read_refresh_intervals(overrides=os.getenv("SECTION_REFRESH_MINUTES", "")):
+    """
+    RETURNS the DICTIONARY of refresh intervals (in minutes) of the sections,
+    updated with the overrides written as "section=minutes" pairs separated by commas.
+    """
+    intervals = dict(SECTION_REFRESH_MINUTES)
+    for pair in overrides.split(","):
+        if "=" in pair:
+            section, minutes = pair.split("=")
+            intervals[section.strip()] = float(minutes)
+
+    return intervals
+
+
+class SectionScheduler:
+    """
+    Keeps track of when each section is due, and of its consecutive failures,
+    in the section_schedule table of postgres.
+    """
+
+    def __init__(self, sections, postrges_engine, intervals=None):
+        self.sections = sections
+        self.pg = postrges_engine
+        self.intervals = intervals if intervals is not None else read_refresh_intervals()
+        self.next_run = {section: dt.datetime.utcnow() for section in sections}
+        self.failures = {section: 0 for section in sections}
+
+        for section, next_run, failures in self.pg.execute(
+                "SELECT section_id, next_run, failures FROM section_schedule;"):
+            if section in self.next_run:
+                self.next_run[section] = next_run
+                self.failures[section] = failures
+        logging.info(
+            "Schedule resumed: " + ", ".join(f"{section} at {self.next_run[section]:%H:%M}" for section in sections))
+
+    def interval(self, section):
+        """RETURNS the refresh interval of a section, as a timedelta."""
+        return dt.timedelta(minutes=self.intervals.get(section, DEFAULT_REFRESH_MINUTES))
+
+    def due_sections(self):
+        """RETURNS the LIST of the sections whose refresh is due, the most overdue first."""
+        now = dt.datetime.utcnow()
+        due = [section for section in self.sections if self.next_run[section] <= now]
+
+        return sorted(due, key=self.next_run.get)
+
+    def seconds_until_next_run(self):
+        """RETURNS the number of seconds before the next section is due (0 if one is due already)."""
+        next_run = min(self.next_run.values())
+
+        return max((next_run - dt.datetime.utcnow()).total_seconds(), 0)
+
+    def mark_success(self, section):
+        """Schedules the next refresh of a section one interval (give or take the jitter) from now."""
+        interval = self.interval(section)
+        jitter = interval * random.uniform(-JITTER, JITTER)
+        self.failures[section] = 0
+        self.checkpoint(section, dt.datetime.utcnow() + interval + jitter)
+
+    def mark_failure(self, section):
+        """
+        Puts a section into the retry queue: it is retried after RETRY_MINUTES,
+        then twice as late after every new failure, but never later than its regular interval.
+        """
+        self.failures[section] += 1
+        delay = min(dt.timedelta(minutes=RETRY_MINUTES * 2 ** (self.failures[section] - 1)), self.interval(section))
+        logging.warning(
+            f"Section {section.upper()} failed {self.failures[section]} time(s) in a row: retrying in {delay}.")
+        self.checkpoint(section, dt.datetime.utcnow() + delay)
+
+    def checkpoint(self, section, next_run):
+        """Records the next run of a section, in memory and in postgres."""
+        self.next_run[section] = next_run
+        self.pg.execute(
+            text("""INSERT INTO section_schedule VALUES (:section, :next_run, :failures)
+                    ON CONFLICT (section_id)
+                    DO UPDATE SET next_run = EXCLUDED.next_run, failures = EXCLUDED.failures;"""),
+            section=section,
+            next_run=next_run,
+            failures=self.failures[section])
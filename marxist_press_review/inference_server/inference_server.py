@@ -0,0 +1,139 @@
+"""
+This module runs the inference server of the press review: it loads the fine-tuned gpt2 model once
+and generates texts for the other services (the article collector and the webapp) over HTTP.
+Requests arriving close together are grouped into dynamically batched forward passes;
+the streamed texts take turns with those batches on the model, STREAM_SLOTS streams at a time.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from flask import Flask, Response, jsonify, request
+from marx_generation import get_model, generate_batch, stream_local
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))  # prompts per forward pass
+MAX_WAIT = float(os.getenv("MAX_BATCH_WAIT_MS", "50")) / 1000  # seconds spent waiting for more requests
+STREAM_SLOTS = int(os.getenv("STREAM_SLOTS", "4"))  # texts streamed at the same time
+PORT = int(os.getenv("INFERENCE_PORT", "5001"))
+
+
+class DynamicBatcher:
+    """
+    Collects the generation requests in a queue; a single worker thread takes the first waiting request,
+    waits up to MAX_WAIT for others to join, and runs the prompts of the requests
+    sharing the same sampling parameters together, up to MAX_BATCH_SIZE prompts per forward pass.
+    The streamed texts go through the batcher as well (see stream( )): each forward pass, of a batch or of a stream,
+    runs under the lock of the model, released between the tokens, so that the streams and the batches take turns
+    token by token and a stream never waits for a whole batch.
+    """
+
+    def __init__(self, ai, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+        self.ai = ai
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.model_lock = threading.Lock()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, prompts, sampling):
+        """Queues a request and blocks until its texts are generated; RETURNS them in the order of the prompts."""
+        pending = {"prompts": prompts, "sampling": sampling, "done": threading.Event(), "texts": None, "error": None}
+        self.requests.put(pending)
+        pending["done"].wait()
+        if pending["error"] is not None:
+            raise pending["error"]
+
+        return pending["texts"]
+
+    def stream(self, prompt, sampling):
+        """RETURNS the pieces of a text streamed from the prompt (see marx_generation.stream_local( )),
+        each token being sampled under the lock of the model."""
+        return stream_local(self.ai, prompt, lock=self.model_lock, **sampling)
+
+    def collect(self):
+        """Waits for a request, then for others arriving within max_wait: RETURNS the LIST of requests."""
+        batch = [self.requests.get()]
+        size = len(batch[0]["prompts"])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending["prompts"])
+
+        return batch
+
+    def run(self):
+        """Main loop of the worker thread."""
+        while True:
+            groups = {}
+            for pending in self.collect():
+                groups.setdefault(tuple(sorted(pending["sampling"].items())), []).append(pending)
+
+            for group in groups.values():
+                try:
+                    prompts = [prompt for pending in group for prompt in pending["prompts"]]
+                    texts = []
+                    for start in range(0, len(prompts), self.max_batch_size):
+                        texts.extend(generate_batch(self.ai, prompts[start:start + self.max_batch_size],
+                                                    lock=self.model_lock, **group[0]["sampling"]))
+                    logging.info(f"Generated {len(prompts)} text(s) for {len(group)} request(s) in one go.")
+                    for pending in group:
+                        pending["texts"], texts = texts[:len(pending["prompts"])], texts[len(pending["prompts"]):]
+                except Exception as error:
+                    logging.exception("Generation failed.")
+                    for pending in group:
+                        pending["error"] = error
+                for pending in group:
+                    pending["done"].set()
+
+
+app = Flask(__name__)
+ai = get_model()
+batcher = DynamicBatcher(ai)
+stream_slots = threading.BoundedSemaphore(STREAM_SLOTS)
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    data = request.get_json()
+    try:
+        texts = batcher.submit(data["prompts"], data.get("sampling", {}))
+    except Exception as error:
+        return jsonify(error=str(error)), 500
+
+    return jsonify(texts=texts)
+
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_stream():
+    if not stream_slots.acquire(blocking=False):
+        return jsonify(error="Too many texts streamed at the same time: try again in a little while."), 503
+    data = request.get_json()
+    pieces = batcher.stream(data["prompt"], data.get("sampling", {}))
+
+    response = Response((json.dumps({"text": piece}) + "\n" for piece in pieces), mimetype="application/x-ndjson")
+    response.call_on_close(stream_slots.release)
+    return response
+
+
+@app.route('/health')
+def health():
+    return jsonify(status="ready")
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=PORT, threaded=True)
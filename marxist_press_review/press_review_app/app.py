@@ -2,14 +2,25 @@
 This module manages the webapp of the marxist press review.
 """
 
+import json
 import logging
 import os
-import pandas as pd
+import threading
 from flask import Flask
+from flask import Response
+from flask import abort
+from flask import jsonify
+from flask import redirect
 from flask import render_template
 from flask import request
+from flask import stream_with_context
+from flask import url_for
 from sqlalchemy import create_engine
-from app_functions import select_articles_from_section, text_generator
+from app_functions import select_articles_from_section, text_generator, text_generator_stream, generator_cache
+from generator_cache import GENERATOR_CACHE_BACKEND
+from generation_jobs import GenerationJobs, QueueFull
+from section_cache import SectionCache
+from marx_generation import model_status, warm_up_model
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s: %(levelname)s: %(message)s')
@@ -24,7 +35,24 @@ HOST = "postgresdb"
 PORT = "5432"  
 DATABASE_NAME = "pg_guardian"
 
+SECTIONS = (
+    'world',
+    'education',
+    'politics',
+    'environment',
+    'global-development',
+    'money',
+    'sport',
+    'business',
+    'culture')
+
+STREAM_SLOTS = int(os.getenv("STREAM_SLOTS", "4"))  # texts streamed at the same time
+WARM_UP_RETRY_AFTER = 5  # seconds the clients are told to wait while the model is loading
+
 app = Flask(__name__)
+jobs = GenerationJobs(text_generator)
+stream_slots = threading.BoundedSemaphore(STREAM_SLOTS)
+warm_up_model()  # the pages are served meanwhile: only the generator needs the model
 
 pg = create_engine(f'postgresql://{POSTGRES_USER}:{POSTGRES_PSW}@{HOST}:{PORT}/{DATABASE_NAME}')
 try:
@@ -34,95 +62,96 @@ except:
     logging.critical(f'Could not connect to server: connection refused.\nIs the server running on host "{HOST}"?\nIs it accepting TCP/IP connections on port {PORT}?\n\nExit.\n') 
     exit()
 
-@app.route('/')
-def start_page():
-    
-    return render_template('start.html')
-
-@app.route('/world')     
-def world_press_review():
-
-    articles = pg.execute(select_articles_from_section('world'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('world.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
-
-@app.route('/education')     
-def education_press_review():
-
-    articles = pg.execute(select_articles_from_section('education'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('education.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
-
-@app.route('/politics')     
-def politics_press_review():
-
-    articles = pg.execute(select_articles_from_section('politics'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('politics.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
-
-@app.route('/environment')     
-def environment_press_review():
-
-    articles = pg.execute(select_articles_from_section('environment'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('environment.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
-
-@app.route('/global-development')     
-def glob_dev_press_review():
+if GENERATOR_CACHE_BACKEND == 'postgres':
+    generator_cache.use_postgres(pg)
 
-    articles = pg.execute(select_articles_from_section('global-development'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('global-development.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
-
-@app.route('/money')     
-def money_press_review():
+def load_section(section):
+    return [dict(article._mapping) for article in pg.execute(select_articles_from_section(section))]
 
-    articles = pg.execute(select_articles_from_section('money'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('money.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
+section_cache = SectionCache(load_section)
+section_cache.listen(pg)
 
-@app.route('/sport')     
-def sport_press_review():
+def model_warming_up():
+    status = model_status()
+    if status == 'failed':
+        warm_up_model()
+    return status not in ('ready', 'remote')
 
-    articles = pg.execute(select_articles_from_section('sport'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('sport.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
-
-@app.route('/business')     
-def business_press_review():
-
-    articles = pg.execute(select_articles_from_section('business'))
-    df = pd.DataFrame(articles, columns=articles.keys())
+@app.route('/')
+def start_page():
     
-    return render_template('business.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
+    return render_template('start.html')
 
-@app.route('/culture')     
-def culture_press_review():
+@app.route('/<section>')
+def section_press_review(section):
+    if section not in SECTIONS:
+        abort(404)
 
-    articles = pg.execute(select_articles_from_section('culture'))
-    df = pd.DataFrame(articles, columns=articles.keys())
-    
-    return render_template('culture.html', ar1=df.loc[0],ar2=df.loc[1],ar3=df.loc[2],ar4=df.loc[3],ar5=df.loc[4])
+    return render_template(f'{section}.html', articles=section_cache.get(section))
 
 
 @app.route('/about')     
 def about():
     return render_template('about.html')
 
+@app.route('/health')
+def health():
+    return jsonify(status='ok', model=model_status())
+
 @app.route('/custom-generator')
 def custom_generator():
-    if request.args:
-        html_data = dict(request.args)
-        prompt = html_data['prompt']
-        result = text_generator(prompt)
-        return render_template('speak.html',result=result)
+    if model_warming_up():
+        return render_template('speak.html', warming_up=True), 503, {'Retry-After': str(WARM_UP_RETRY_AFTER)}
+    elif 'prompt' in request.args:
+        try:
+            job_id = jobs.submit(request.args['prompt'])
+        except QueueFull:
+            return render_template('speak.html', busy=True), 429
+        return redirect(url_for('custom_generator', job=job_id))
+    elif 'job' in request.args:
+        job = jobs.get(request.args['job'])
+        if job is None or job['status'] == 'failed':
+            return render_template('speak.html', result="GPT-2-Marx could not generate any text from this prompt. Try something else.")
+        elif job['status'] == 'done':
+            return render_template('speak.html', result=job['result'])
+        return render_template('speak.html', job_id=request.args['job'])
     else:
         return render_template('speak.html')
 
+@app.route('/custom-generator/jobs', methods=['POST'])
+def submit_generation_job():
+    if model_warming_up():
+        return jsonify(error='GPT-2-Marx is warming up: try again in a few seconds.'), 503, {'Retry-After': str(WARM_UP_RETRY_AFTER)}
+    prompt = (request.get_json(silent=True) or request.form).get('prompt', '')
+    try:
+        job_id = jobs.submit(prompt)
+    except QueueFull:
+        return jsonify(error='Too many requests: try again in a little while.'), 429
+    return jsonify(job_id=job_id, status_url=url_for('generation_job_status', job_id=job_id)), 202
+
+@app.route('/custom-generator/jobs/<job_id>')
+def generation_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error='Unknown or expired job.'), 404
+    return jsonify(job_id=job_id, **job)
+
+@app.route('/custom-generator/stream')
+def custom_generator_stream():
+    if model_warming_up():
+        return jsonify(error='GPT-2-Marx is warming up: try again in a few seconds.'), 503, {'Retry-After': str(WARM_UP_RETRY_AFTER)}
+    if not stream_slots.acquire(blocking=False):
+        return jsonify(error='Too many requests: try again in a little while.'), 429
+
+    def events():
+        for event, text in text_generator_stream(request.args.get('prompt', '')):
+            yield f"event: {event}\ndata: {json.dumps({'text': text})}\n\n"
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(stream_slots.release)
+    return response
+
+@app.route('/custom-generator/cache-stats')
+def generator_cache_stats():
+    return jsonify(generator_cache.stats())
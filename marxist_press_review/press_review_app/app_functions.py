@@ -1,89 +1,119 @@
 """
 This module contains:
-1) the function that feeds the webapp page for the user to generate marxist text given a prompt; 
+1) the functions that feed the webapp page for the user to generate marxist text given a prompt
+(all at once, or streamed while it is generated);
 2) A function that generates sql queries for the different pages of the webapp.
 """
 
-import re
+import os
+import time
 import logging
-from aitextgen import aitextgen
+from marx_generation import STOP_AT_SENTENCE, generate_candidates, stream_text
+from text_cleanup import clean_generated_text, extract_first_sentence
+from generator_cache import GeneratorCache
+from section_queries import SECTION_QUERY
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s: %(levelname)s: %(message)s")
 
 
-ai = aitextgen(model_folder="trained_model")
-
-NO_TRUNC_INITIAL_SENTENCE_PATTERN = r"^[A-Z][a-z]+.+\."
-REGEX = {
-    r"\n": " ",
-    r"\\'": "’",
-    r"\[.+?\]": "",
-    r"\[.+?\.": ".",
-    r"  [0-9]+.": "",
-    r"\(\?\)": "",
-    r"\([0-9]{1,2}\)": "",
-    r"[<>]": "",
-    r"\.+": ".",
-    r" \. ": ". ",
-    r"\|\|[A-Z]+\|": "",
-    r"(\.)[A-Za-z0-9]+": ". ",
-    r" {2,}": " ",
-    r'''(.\")[A-Za-z0-9]''':'. "'
-}
+SAMPLING_PARAMETERS = {
+    "min_length": 10,
+    "max_length": 70,
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "repetition_penalty": 1.1,
+    "no_repeat_ngram_size": 2,
+    "stop_at_sentence": STOP_AT_SENTENCE}
+
+# Number of texts sampled per prompt: the first one holding a complete sentence is shown.
+GENERATION_CANDIDATES = int(os.getenv("GENERATION_CANDIDATES", "4"))
+
+# The cached statements are kept per prompt, sampling parameters and number of candidates:
+# a streamed statement comes from a single sample, so it is kept apart from the ranked ones
+CACHE_PARAMETERS = dict(SAMPLING_PARAMETERS, candidates=GENERATION_CANDIDATES)
+STREAM_CACHE_PARAMETERS = dict(SAMPLING_PARAMETERS, candidates=1)
+generator_cache = GeneratorCache()
+
+NO_TEXT = "GPT-2-Marx could not generate any text from this prompt. Try something else."
+TOO_LONG = "Uh...we had said no more than FIVE words, right? 😅 "
+
+
+def clean_marx_statement(marx_statement):
+    """Cleans a text produced by the gpt2 model and keeps its first complete sentence,
+    or returns the failure message if there is none."""
+    marx_comment = extract_first_sentence(marx_statement)
+
+    return NO_TEXT if marx_comment is None else marx_comment
+
+
+def generate_marx_statement(prompt):
+    """Samples GENERATION_CANDIDATES texts from the prompt and RETURNS the first complete sentence
+    of the first candidate that has one (or the failure message)."""
+    marx_statements = generate_candidates(
+        [prompt.capitalize()], GENERATION_CANDIDATES, 1, **SAMPLING_PARAMETERS)[0]
+    marx_comment = NO_TEXT
+    for marx_statement in marx_statements:
+        marx_comment = clean_marx_statement(marx_statement)
+        if marx_comment != NO_TEXT:
+            break
+
+    return marx_comment
+
 
 def text_generator(prompt):
     """Generates marxist text based on a textual input.
+    Statements are served from the cache of the generator when it has them.
     ----
     ARGUMENT: A string of max 4 words.
     """
     prompt_words = prompt.split()
     if prompt == "":
-        marx_comment = "GPT-2-Marx could not generate any text from this prompt. Try something else."
+        marx_comment = NO_TEXT
     elif len(prompt_words) > 5:
-        marx_comment = "Uh...we had said no more than FIVE words, right? 😅 "
+        marx_comment = TOO_LONG
     elif len(prompt_words) <= 5:
-        marx_statement = ai.generate_one(
-            prompt=prompt.capitalize(),
-            min_length=10,
-            max_length=70,
-            temperature=0.7,
-            top_p=0.9,
-            repetition_penalty=1.1,
-            no_repeat_ngram_size=2,
-        )
-
-        for key, index in REGEX.items():
-            sentence = re.sub(key, index, marx_statement)
-
-        marx_statement_clean = re.findall(NO_TRUNC_INITIAL_SENTENCE_PATTERN, sentence)
-
-        if len(marx_statement_clean) == 0:
-            marx_comment = "GPT-2-Marx could not generate any text from this prompt. Try something else."
-        else:
-            marx_comment = marx_statement_clean[0]
+        marx_comment = generator_cache.get_or_generate(
+            prompt, CACHE_PARAMETERS, lambda: generate_marx_statement(prompt),
+            cacheable=lambda statement: statement != NO_TEXT)
 
     return marx_comment
 
+
+def text_generator_stream(prompt):
+    """Streaming version of text_generator( ): yields ("token", text) events while the text is sampled,
+    the text being the cleaned statement so far, then a ("final", text) event
+    carrying the same statement as text_generator( ) would have returned.
+    Cached statements are sent at once as the final event.
+    ----
+    ARGUMENT: A string of max 4 words.
+    """
+    prompt_words = prompt.split()
+    if prompt == "" or len(prompt_words) > 5:
+        yield "final", text_generator(prompt)
+        return
+
+    cached = generator_cache.lookup(prompt, STREAM_CACHE_PARAMETERS)
+    if cached is not None:
+        yield "final", cached
+        return
+
+    start = time.perf_counter()
+    marx_statement = ""
+    for piece in stream_text(prompt.capitalize(), **SAMPLING_PARAMETERS):
+        marx_statement += piece
+        yield "token", clean_generated_text(marx_statement)
+
+    marx_comment = clean_marx_statement(marx_statement)
+    if marx_comment != NO_TEXT:
+        generator_cache.store(prompt, STREAM_CACHE_PARAMETERS, marx_comment, time.perf_counter() - start)
+    yield "final", marx_comment
+
+
 def select_articles_from_section(section):
     """
     Takes a STRING matching one possible value for the "section_id" column of the Guardian SQL database
-    and completes the query accordingly.
+    and RETURNS the query of the five latest articles of the section, with the section as a bound parameter
+    (served by the index guardian_articles_section_date_idx).
     """
-    query = f"""SELECT date,
-                              title,
-                              author,
-                              body,
-                              img_url,
-                              img_descr,
-                              img_cred,
-                              short_url,
-                              marx_comment,
-                              marx_judgement 
-                        FROM guardian_articles
-                        WHERE section_id = '{section}'
-                        ORDER BY date DESC
-                        LIMIT 5
-                        ;"""
-
-    return query
+    return SECTION_QUERY.bindparams(section=section)
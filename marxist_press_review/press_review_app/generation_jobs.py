@@ -0,0 +1,81 @@
+"""
+This module contains the job queue of the interactive generator of the webapp:
+the prompts are queued, and a pool of worker threads generates the texts in the background,
+so that no Flask worker waits for the gpt2 model. The webapp polls the jobs for their results.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))  # queued jobs beyond which new ones are refused
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "2"))
+JOB_TTL = 60 * 10  # seconds during which a finished job can be polled
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is full."""
+
+
+class GenerationJobs:
+    """
+    A bounded queue of generation jobs served by a pool of worker threads.
+    Each job is a dictionary with its "status" ("queued", "running", "done" or "failed") and its "result".
+    """
+
+    def __init__(self, function, workers=GENERATION_WORKERS, max_queued=JOB_QUEUE_SIZE):
+        self.function = function
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def submit(self, prompt):
+        """Queues a prompt and RETURNS the id of its job; raises QueueFull if there is no room left."""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.forget_old_jobs()
+            self.jobs[job_id] = {"status": "queued", "result": None, "finished": None}
+        try:
+            self.queue.put_nowait((job_id, prompt))
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job_id]
+            raise QueueFull()
+
+        return job_id
+
+    def get(self, job_id):
+        """RETURNS a copy of a job (status and result), or None if it is unknown or expired."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else {"status": job["status"], "result": job["result"]}
+
+    def forget_old_jobs(self):
+        """Drops the jobs finished more than JOB_TTL seconds ago (to be called with the lock held)."""
+        now = time.monotonic()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job["finished"] is not None and now - job["finished"] > JOB_TTL]:
+            del self.jobs[job_id]
+
+    def work(self):
+        """Main loop of a worker thread."""
+        while True:
+            job_id, prompt = self.queue.get()
+            with self.lock:
+                self.jobs[job_id]["status"] = "running"
+            try:
+                result, status = self.function(prompt), "done"
+            except Exception:
+                logging.exception("A generation job has failed.")
+                result, status = None, "failed"
+            with self.lock:
+                self.jobs[job_id].update(status=status, result=result, finished=time.monotonic())
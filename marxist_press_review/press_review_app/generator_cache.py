@@ -0,0 +1,205 @@
+"""
+This module contains the cache of the interactive generator of the webapp:
+the statements are kept per normalised prompt and sampling parameters, in a bounded LRU with a time-to-live,
+either in memory (one cache per worker) or in postgres (one cache shared by all the workers).
+With more than one variant per prompt, the cache keeps generating until it holds that many statements,
+and then serves one of them at random, so that the answers stay varied.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.sql import text
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+GENERATOR_CACHE_SIZE = int(os.getenv("GENERATOR_CACHE_SIZE", "1000"))  # prompts
+GENERATOR_CACHE_TTL = int(os.getenv("GENERATOR_CACHE_TTL", f"{60 * 60 * 24}"))  # seconds
+GENERATOR_CACHE_VARIANTS = int(os.getenv("GENERATOR_CACHE_VARIANTS", "1"))  # statements kept per prompt
+GENERATOR_CACHE_BACKEND = os.getenv("GENERATOR_CACHE_BACKEND", "memory")  # "memory" or "postgres"
+# With postgres, the expired statements and the least recently used keys are evicted once every EVICT_EVERY saves
+# of a worker (the cache may hold a few more keys than GENERATOR_CACHE_SIZE in between),
+# and the last use of a key is only written again once it is older than TOUCH_INTERVAL seconds.
+GENERATOR_CACHE_EVICT_EVERY = int(os.getenv("GENERATOR_CACHE_EVICT_EVERY", "50"))
+GENERATOR_CACHE_TOUCH_INTERVAL = int(os.getenv("GENERATOR_CACHE_TOUCH_INTERVAL", "60"))
+
+
+def cache_key(prompt, parameters):
+    """RETURNS the key of a prompt: the prompt lowercased with its blanks normalised, and the sampling parameters."""
+    return f"{' '.join(prompt.lower().split())}|{json.dumps(parameters, sort_keys=True)}"
+
+
+class GeneratorCache:
+    """
+    Bounded LRU/TTL cache of generated statements, with hit and miss counters
+    (kept in postgres too with the shared backend, so that they add up the lookups of all the workers).
+    The time spent by the model on the misses gives an estimate of the time saved by the hits.
+    """
+
+    def __init__(self, size=GENERATOR_CACHE_SIZE, ttl=GENERATOR_CACHE_TTL, variants=GENERATOR_CACHE_VARIANTS,
+                 evict_every=GENERATOR_CACHE_EVICT_EVERY, touch_interval=GENERATOR_CACHE_TOUCH_INTERVAL):
+        self.size = size
+        self.ttl = ttl
+        self.variants = variants
+        self.evict_every = evict_every
+        self.touch_interval = touch_interval
+        self.saves = 0  # saves into postgres since the last eviction
+        self.entries = OrderedDict()  # key -> LIST of (creation time, statement)
+        self.pg = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation_time = 0.0
+        self.generations = 0
+
+    def use_postgres(self, postrges_engine):
+        """Moves the cache into postgres, so that all the workers of the webapp share it."""
+        postrges_engine.execute(
+            """CREATE UNLOGGED TABLE IF NOT EXISTS generator_cache (
+                cache_key VARCHAR(2000),
+                statement VARCHAR(1100),
+                created TIMESTAMP DEFAULT now()
+                );
+            ALTER TABLE generator_cache ADD COLUMN IF NOT EXISTS last_used TIMESTAMP DEFAULT now();
+            CREATE INDEX IF NOT EXISTS generator_cache_key_idx ON generator_cache (cache_key, created);
+            CREATE UNLOGGED TABLE IF NOT EXISTS generator_cache_stats (
+                counter VARCHAR(50) PRIMARY KEY,
+                value DOUBLE PRECISION
+                );
+        """)
+        self.pg = postrges_engine
+        logging.info("The cache of the generator is shared through postgres.")
+
+    def load(self, key):
+        """RETURNS the LIST of the statements cached under a key that have not expired, and marks the key as just used
+        (in postgres, only if its last use is older than self.touch_interval, so that most lookups write nothing)."""
+        if self.pg is not None:
+            rows = self.pg.execute(
+                text("""WITH touched AS (
+                            UPDATE generator_cache SET last_used = now()
+                            WHERE cache_key = :key AND created > now() - make_interval(secs => :ttl)
+                            AND last_used < now() - make_interval(secs => :touch_interval))
+                        SELECT statement FROM generator_cache
+                        WHERE cache_key = :key AND created > now() - make_interval(secs => :ttl);"""
+                     ).execution_options(autocommit=True),  # not detected as a write, since it starts with WITH
+                key=key, ttl=self.ttl, touch_interval=self.touch_interval)
+            return [row[0] for row in rows]
+
+        with self.lock:
+            now = time.time()
+            variants = [(created, statement) for created, statement in self.entries.get(key, [])
+                        if now - created < self.ttl]
+            if variants:
+                self.entries[key] = variants
+                self.entries.move_to_end(key)
+            else:
+                self.entries.pop(key, None)
+            return [statement for _, statement in variants]
+
+    def save(self, key, statement):
+        """Adds a statement to the ones cached under a key, keeping the newest self.variants of them,
+        and evicts the least recently used keys if needed (in postgres, together with the expired statements,
+        once every self.evict_every saves)."""
+        if self.pg is not None:
+            self.pg.execute(
+                text("""INSERT INTO generator_cache (cache_key, statement) VALUES (:key, :generated);
+                        DELETE FROM generator_cache WHERE cache_key = :key AND ctid NOT IN (
+                            SELECT ctid FROM generator_cache WHERE cache_key = :key
+                            ORDER BY created DESC LIMIT :variants);"""),
+                key=key, generated=statement, variants=self.variants)
+            with self.lock:
+                self.saves += 1
+                evict = self.saves >= self.evict_every
+                if evict:
+                    self.saves = 0
+            if evict:
+                self.evict()
+            return
+
+        with self.lock:
+            self.entries.setdefault(key, []).append((time.time(), statement))
+            self.entries[key] = self.entries[key][-self.variants:]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def evict(self):
+        """Deletes from postgres the expired statements and the least recently used keys beyond self.size."""
+        self.pg.execute(
+            text("""DELETE FROM generator_cache WHERE created <= now() - make_interval(secs => :ttl);
+                    DELETE FROM generator_cache WHERE cache_key IN (
+                        SELECT cache_key FROM generator_cache
+                        GROUP BY cache_key ORDER BY max(last_used) DESC OFFSET :size);"""),
+            ttl=self.ttl, size=self.size)
+
+    def count(self, **increments):
+        """Adds the increments to the counters (hits, misses, generation_time, generations),
+        in postgres with the shared backend or else in the memory of the worker."""
+        if self.pg is not None:
+            self.pg.execute(
+                text("""INSERT INTO generator_cache_stats (counter, value)
+                        SELECT * FROM unnest(CAST(:counters AS VARCHAR[]), CAST(:increments AS DOUBLE PRECISION[]))
+                        ON CONFLICT (counter) DO UPDATE SET value = generator_cache_stats.value + EXCLUDED.value;"""),
+                counters=list(increments), increments=list(increments.values()))
+            return
+
+        with self.lock:
+            for counter, increment in increments.items():
+                setattr(self, counter, getattr(self, counter) + increment)
+
+    def counters(self):
+        """RETURNS the DICTIONARY of the counters, from postgres with the shared backend."""
+        if self.pg is not None:
+            values = dict(self.pg.execute("SELECT counter, value FROM generator_cache_stats;").fetchall())
+            return {counter: values.get(counter, 0) for counter in ("hits", "misses", "generation_time", "generations")}
+
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "generation_time": self.generation_time, "generations": self.generations}
+
+    def lookup(self, prompt, parameters):
+        """RETURNS a cached statement for the prompt (one of the variants, at random), or None on a miss."""
+        variants = self.load(cache_key(prompt, parameters))
+        if len(variants) >= self.variants:
+            self.count(hits=1)
+            return random.choice(variants)
+        self.count(misses=1)
+        return None
+
+    def store(self, prompt, parameters, statement, generation_time):
+        """Caches the statement generated for a prompt, and counts the time the model spent on it."""
+        self.save(cache_key(prompt, parameters), statement)
+        self.count(generation_time=generation_time, generations=1)
+
+    def get_or_generate(self, prompt, parameters, generate, cacheable=lambda statement: True):
+        """RETURNS a cached statement for the prompt, or one produced by generate( ) on a miss,
+        which is then cached if cacheable( ) accepts it."""
+        statement = self.lookup(prompt, parameters)
+        if statement is not None:
+            return statement
+
+        start = time.perf_counter()
+        statement = generate()
+        if cacheable(statement):
+            self.store(prompt, parameters, statement, time.perf_counter() - start)
+        return statement
+
+    def stats(self):
+        """RETURNS the hit and miss counters, and an estimate of the model time saved by the hits (in seconds):
+        those of all the workers with the postgres backend, those of this worker with the memory one."""
+        counters = self.counters()
+        hits, misses = int(counters["hits"]), int(counters["misses"])
+        mean_generation_time = counters["generation_time"] / counters["generations"] if counters["generations"] else 0.0
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "model_time_saved": hits * mean_generation_time,
+            "backend": "postgres" if self.pg is not None else "memory",
+            "scope": "all workers" if self.pg is not None else f"worker {os.getpid()}"}
@@ -0,0 +1,92 @@
+"""
+This module contains the cache of the section pages of the webapp: the articles displayed on each section page
+are kept in memory for SECTION_CACHE_TTL seconds at most, and dropped as soon as the article collector
+notifies new articles for the section through postgres (LISTEN/NOTIFY on ARTICLES_CHANNEL).
+"""
+
+import logging
+import os
+import select
+import threading
+import time
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+SECTION_CACHE_TTL = int(os.getenv("SECTION_CACHE_TTL", "300"))  # seconds, in case a notification is missed
+# Channel notified by the article collector when it writes articles (see api_cleaning_functions.ARTICLES_CHANNEL)
+ARTICLES_CHANNEL = "guardian_articles"
+LISTEN_TIMEOUT = 60  # seconds between two checks of the listening connection
+LISTEN_RETRY = 10  # seconds before listening again after the connection has been lost
+
+
+class SectionCache:
+    """
+    In-memory TTL cache of the articles of each section, filled by load(section) on a miss
+    and invalidated by the notifications of the article collector.
+    """
+
+    def __init__(self, load, ttl=SECTION_CACHE_TTL):
+        self.load = load
+        self.ttl = ttl
+        self.entries = {}  # section -> (load time, LIST of articles)
+        self.version = 0  # incremented by each invalidation
+        self.lock = threading.Lock()
+
+    def get(self, section):
+        """RETURNS the LIST of the articles of a section, loading them if they are not cached or have expired."""
+        with self.lock:
+            entry = self.entries.get(section)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                return entry[1]
+            version = self.version
+
+        articles = self.load(section)
+        with self.lock:
+            if self.version == version:  # not invalidated while loading
+                self.entries[section] = (time.time(), articles)
+        return articles
+
+    def invalidate(self, section=""):
+        """Drops the cached articles of a section, or of all the sections if no section is given."""
+        with self.lock:
+            self.version += 1
+            if section:
+                self.entries.pop(section, None)
+            else:
+                self.entries.clear()
+
+    def listen(self, postrges_engine, channel=ARTICLES_CHANNEL):
+        """Starts a background thread that invalidates the cache on each notification received on the channel."""
+        listener = threading.Thread(
+            target=self.listen_forever, args=(postrges_engine, channel), name="section-cache-listener", daemon=True)
+        listener.start()
+
+    def listen_forever(self, postrges_engine, channel):
+        """Listens to the channel on a dedicated connection, and connects again whenever the connection is lost."""
+        while True:
+            connection = None
+            try:
+                raw_connection = postrges_engine.raw_connection()
+                raw_connection.detach()  # kept out of the pool of the engine
+                connection = raw_connection.connection
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute(f"LISTEN {channel};")
+                self.invalidate()  # the notifications sent while not listening are lost
+                logging.info(f"The cache of the section pages listens to the notifications on {channel}.")
+
+                while True:
+                    if select.select([connection], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                        # raises if the connection is lost; a notification arriving meanwhile is read with its result
+                        connection.cursor().execute("SELECT 1;")
+                    connection.poll()
+                    while connection.notifies:
+                        self.invalidate(connection.notifies.pop(0).payload)
+            except Exception:
+                logging.exception(
+                    f"The cache of the section pages stopped listening to {channel}: retrying in {LISTEN_RETRY} seconds.")
+                if connection is not None:
+                    connection.close()
+                time.sleep(LISTEN_RETRY)
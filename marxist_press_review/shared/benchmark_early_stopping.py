@@ -0,0 +1,66 @@
+"""
+This module measures what the early stopping at the first complete sentence saves:
+it generates comments on a set of prompts with and without stop_at_sentence,
+and prints the tokens generated, the latency and the length of the comment kept (in words) per comment,
+since a text stopped early keeps a shorter comment (see STOP_AT_SENTENCE).
+Run it next to a trained_model folder (or set MODEL_FOLDER): python benchmark_early_stopping.py
+"""
+
+import time
+from marx_generation import get_model, sample_tokens
+from text_cleanup import extract_first_sentence
+
+PROMPTS = [
+    "The government has announced new measures to tackle the cost",
+    "Workers at the biggest car factory in the country walked",
+    "Shares in the online retailer fell sharply after the company",
+    "The prime minister faces a rebellion from backbenchers over plans",
+    "Climate activists blocked the entrance of the oil company's headquarters",
+    "The football club's owners have agreed to sell to a",
+    "Teachers are warning that the school funding crisis will force",
+    "Landlords have been accused of exploiting tenants as rents rise"]
+SAMPLING = {
+    "min_length": 15,
+    "max_length": 70,
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "repetition_penalty": 1.1,
+    "no_repeat_ngram_size": 2}
+BATCH_SIZE = 8
+ROUNDS = 3
+
+
+def measure(ai, stop_at_sentence):
+    """RETURNS the mean number of tokens generated, the mean latency (seconds)
+    and the mean length (words) of the first sentence kept, per comment."""
+    tokens_generated = 0
+    words = 0
+    sampling_time = 0
+    for _ in range(ROUNDS):
+        generated = [[] for _ in PROMPTS[:BATCH_SIZE]]
+        start = time.perf_counter()
+        for tokens in sample_tokens(ai, PROMPTS[:BATCH_SIZE], stop_at_sentence=stop_at_sentence, **SAMPLING):
+            for sequence, token in zip(generated, tokens):
+                if token is not None:
+                    sequence.append(token)
+        sampling_time += time.perf_counter() - start
+        for prompt, sequence in zip(PROMPTS, generated):
+            tokens_generated += len(sequence)
+            comment = extract_first_sentence(prompt + ai.tokenizer.decode(sequence, skip_special_tokens=True))
+            words += 0 if comment is None else len(comment.split())
+    comments = ROUNDS * len(PROMPTS[:BATCH_SIZE])
+
+    return tokens_generated / comments, sampling_time / comments, words / comments
+
+
+if __name__ == "__main__":
+
+    ai = get_model()
+    full_tokens, full_latency, full_words = measure(ai, stop_at_sentence=False)
+    early_tokens, early_latency, early_words = measure(ai, stop_at_sentence=True)
+
+    print(f"{'mode':<22}{'tokens/comment':>16}{'latency/comment (ms)':>22}{'words/comment':>15}")
+    print(f"{'up to max_length':<22}{full_tokens:>16.1f}{full_latency * 1000:>22.1f}{full_words:>15.1f}")
+    print(f"{'stop at 1st sentence':<22}{early_tokens:>16.1f}{early_latency * 1000:>22.1f}{early_words:>15.1f}")
+    print(f"Saved: {full_tokens - early_tokens:.1f} tokens and {(full_latency - early_latency) * 1000:.1f} ms per comment "
+          f"({1 - early_latency / full_latency:.0%} of the latency).")
@@ -0,0 +1,106 @@
+"""
+This module compares the int8 backend of marx_generation with the fp32 model on the CPU:
+1) the size of the weights;
+2) the memory of a process using each backend: its peak resident set size once the model is loaded
+with load_model( ), as a service does, then after one batch of comments (each backend in a fresh process);
+3) the latency per comment, with the sampling parameters of the collector;
+4) a sanity check of the quality: on the comments sampled by the fp32 model, how often the int8 model
+predicts the same next token, the perplexity of both models, and the share of usable comments of each backend.
+Run it next to a trained_model folder (or set MODEL_FOLDER): python benchmark_quantization.py
+"""
+
+import io
+import copy
+import math
+import multiprocessing
+import resource
+import time
+import types
+import torch
+from marx_generation import encode_prompts, generate_batch, load_model, quantize_model
+from text_cleanup import extract_first_sentence
+from benchmark_early_stopping import PROMPTS, SAMPLING, BATCH_SIZE, ROUNDS
+
+
+def weights_size(model):
+    """RETURNS the size (bytes) of the serialized weights of the model."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+
+    return buffer.getbuffer().nbytes
+
+
+def peak_memory(backend):
+    """Loads the model with the backend, then samples one batch of comments, in the calling process.
+    RETURNS its peak resident set size (bytes) after the loading and after the generation."""
+    ai = load_model(backend)
+    loaded = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KB on Linux
+    generate_batch(ai, PROMPTS[:BATCH_SIZE], **SAMPLING)
+    generated = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return loaded, generated
+
+
+def measure_memory(backend):
+    """RETURNS the peak resident set sizes of peak_memory( ), measured in a fresh process
+    so that the memory of one backend does not hide the other."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(peak_memory, (backend,))
+
+
+def measure_latency(ai):
+    """Samples the comments on the prompts ROUNDS times.
+    RETURNS the mean latency (seconds) per comment and the LIST of the generated texts."""
+    texts = []
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        texts.extend(generate_batch(ai, PROMPTS[:BATCH_SIZE], **SAMPLING))
+
+    return (time.perf_counter() - start) / len(texts), texts
+
+
+def score_texts(ai, texts):
+    """Runs the model over the texts at once.
+    RETURNS the predicted next tokens, the perplexity of the model on the texts and the mask of their real tokens."""
+    input_ids, attention_mask, _ = encode_prompts(ai, texts)
+    position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+    with torch.no_grad():
+        logits = ai.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids).logits
+
+    targets, mask = input_ids[:, 1:], attention_mask[:, 1:].bool()
+    log_probs = torch.log_softmax(logits[:, :-1].float(), dim=-1).gather(2, targets[:, :, None]).squeeze(2)
+
+    return logits[:, :-1].argmax(dim=-1), math.exp(-log_probs[mask].mean().item()), mask
+
+
+def usable_share(texts):
+    """RETURNS the share of the texts from which the services would keep a first sentence."""
+    return sum(extract_first_sentence(text) is not None for text in texts) / len(texts)
+
+
+if __name__ == "__main__":
+
+    memory = {backend: measure_memory(backend) for backend in ("fp32", "int8")}
+
+    fp32 = load_model("fp32")
+    int8 = types.SimpleNamespace(tokenizer=fp32.tokenizer, model=quantize_model(copy.deepcopy(fp32.model)))
+
+    torch.manual_seed(0)
+    fp32_latency, fp32_texts = measure_latency(fp32)
+    torch.manual_seed(0)
+    int8_latency, int8_texts = measure_latency(int8)
+
+    fp32_predictions, fp32_perplexity, mask = score_texts(fp32, fp32_texts)
+    int8_predictions, int8_perplexity, _ = score_texts(int8, fp32_texts)
+    agreement = (fp32_predictions == int8_predictions)[mask].float().mean().item()
+
+    print(f"{'backend':<10}{'weights (MB)':>14}{'RSS loaded (MB)':>17}{'RSS generated (MB)':>20}"
+          f"{'latency/comment (ms)':>22}{'perplexity':>12}{'usable':>9}")
+    for name, model, latency, perplexity, texts in [
+            ("fp32", fp32.model, fp32_latency, fp32_perplexity, fp32_texts),
+            ("int8", int8.model, int8_latency, int8_perplexity, int8_texts)]:
+        loaded, generated = memory[name]
+        print(f"{name:<10}{weights_size(model) / 2**20:>14.1f}{loaded / 2**20:>17.1f}{generated / 2**20:>20.1f}"
+              f"{latency * 1000:>22.1f}{perplexity:>12.2f}{usable_share(texts):>9.0%}")
+    print(f"Speed-up: {fp32_latency / int8_latency:.2f}x. "
+          f"The int8 model predicts the same next token as the fp32 model for {agreement:.1%} of the tokens.")
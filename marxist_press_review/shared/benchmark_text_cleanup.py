@@ -0,0 +1,66 @@
+"""
+This module compares the cleanup of the generated texts of text_cleanup with the loops it replaces:
+1) the former loop of the services, which only kept the last pattern (re.sub on the raw text at every step);
+2) the same loop made cumulative, with the patterns compiled on the fly by re.sub( );
+3) the patterns merged into alternations, one pass per run of order-independent patterns;
+4) the engine of text_cleanup.
+It checks that the engine gives the same results as the cumulative loop, and prints the time per text.
+Run it with: python benchmark_text_cleanup.py
+"""
+
+import random
+import re
+import time
+from text_cleanup import GENERATION_REGEX, clean_generated_text
+
+SAMPLES = 20000
+WORDS = ["the", "bourgeoisie", "has", "played", "a", "most", "revolutionary", "part", "in", "history",
+         "workers", "capital", "labour", "of", "and", "The", "Proletarians"]
+ARTEFACTS = [" [1]", " [see note.", " (?)", " (12)", " <", ">", "...", " . ", "||MEGA|", "\n", "  42.",
+             "\\'", '"a', ".Word", "  "]
+
+
+def former_loop(marx_statement):
+    for key, index in GENERATION_REGEX.items():
+        sentence = re.sub(key, index, marx_statement)
+    return sentence
+
+
+def cumulative_loop(marx_statement):
+    for key, index in GENERATION_REGEX.items():
+        marx_statement = re.sub(key, index, marx_statement)
+    return marx_statement
+
+
+MERGED = [
+    (re.compile(r"\n"), " "),
+    (re.compile(r"\\'"), "’"),
+    (re.compile(r"(?P<a>\[.+?\])|(?P<b>\[.+?\.)|(?P<c>  [0-9]+.)|(?P<d>\(\?\))|(?P<e>\([0-9]{1,2}\))|(?P<f>[<>])"),
+     lambda match: "." if match.lastgroup == "b" else ""),
+] + [(re.compile(pattern), replacement) for pattern, replacement in list(GENERATION_REGEX.items())[8:]]
+
+
+def merged_alternations(marx_statement):
+    for pattern, replacement in MERGED:
+        marx_statement = pattern.sub(replacement, marx_statement)
+    return marx_statement
+
+
+def synthetic_texts(artefact_rate):
+    """RETURNS SAMPLES texts of 60 words, with one artefact for 1/artefact_rate words on average."""
+    random.seed(0)
+    return ["".join(random.choice(ARTEFACTS) if random.random() < artefact_rate else f" {random.choice(WORDS)}"
+                    for _ in range(60)) for _ in range(SAMPLES)]
+
+
+if __name__ == "__main__":
+
+    for label, artefact_rate in [("realistic (2% artefacts)", 0.02), ("dense (30% artefacts)", 0.3)]:
+        texts = synthetic_texts(artefact_rate)
+        mismatches = sum(clean_generated_text(text) != cumulative_loop(text) for text in texts)
+        print(f"\n{label}: {mismatches} difference(s) between text_cleanup and the cumulative loop")
+        for function in (former_loop, cumulative_loop, merged_alternations, clean_generated_text):
+            start = time.perf_counter()
+            for text in texts:
+                function(text)
+            print(f"{function.__name__:<22}{(time.perf_counter() - start) / SAMPLES * 1e6:>8.1f} µs/text")
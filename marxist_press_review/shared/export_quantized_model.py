@@ -0,0 +1,28 @@
+"""
+This module exports the fine-tuned gpt2 model for the int8 backend of marx_generation (MODEL_BACKEND=int8):
+it quantizes pytorch_model.bin and saves the weights of the quantized model next to it (QUANTIZED_MODEL_FILE),
+so that the services load them directly instead of reading and quantizing the fp32 weights on every start.
+Run it next to a trained_model folder (or set MODEL_FOLDER): python export_quantized_model.py
+"""
+
+import os
+import logging
+import torch
+from marx_generation import MODEL_FOLDER, QUANTIZED_MODEL_FILE, load_model
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+if __name__ == "__main__":
+
+    if os.path.exists(QUANTIZED_MODEL_FILE):
+        os.remove(QUANTIZED_MODEL_FILE)  # quantize the current pytorch_model.bin, not a former export
+    ai = load_model("int8")
+    torch.save(ai.model.state_dict(), QUANTIZED_MODEL_FILE)
+
+    fp32_size = os.path.getsize(os.path.join(MODEL_FOLDER, "pytorch_model.bin"))
+    int8_size = os.path.getsize(QUANTIZED_MODEL_FILE)
+    logging.info(f"Saved {QUANTIZED_MODEL_FILE}: {int8_size / 2**20:.0f} MB "
+                 f"(pytorch_model.bin: {fp32_size / 2**20:.0f} MB).")
@@ -0,0 +1,359 @@
+"""
+This module contains the text generation with the fine-tuned gpt2 model, shared by the services of the press review:
+1) the batched sampling of one text per prompt;
+2) the token-by-token sampling used to stream a text while it is generated;
+3) the choice between the local model and the inference server (see INFERENCE_SERVER_URL),
+and the loading of the local model in the background (see warm_up_model);
+4) the optional int8 backend of the local model, dynamically quantized for the CPU (see MODEL_BACKEND).
+The functions are used by the modules marxist_text_generator, app_functions and inference_server.
+torch, aitextgen and transformers are only imported by the functions running the local model,
+so that a service generating its texts on the inference server does not load them.
+"""
+
+import os
+import json
+import logging
+import threading
+from contextlib import nullcontext
+import requests
+from text_cleanup import extract_first_sentence
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s: %(message)s")
+
+
+MODEL_FOLDER = os.getenv("MODEL_FOLDER", "trained_model")
+# When set, the texts are generated by the inference server at this URL instead of a local copy of the model
+INFERENCE_SERVER_URL = os.getenv("INFERENCE_SERVER_URL")
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "300"))  # seconds
+# "fp32" runs the fine-tuned weights as they are; "int8" quantizes the linear layers of the model for the CPU
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "fp32")
+MODEL_BACKENDS = ("fp32", "int8")
+# Written by export_quantized_model.py: with the int8 backend, it is loaded instead of quantizing pytorch_model.bin
+QUANTIZED_MODEL_FILE = os.path.join(MODEL_FOLDER, os.getenv("QUANTIZED_MODEL_FILE", "quantized_model.pt"))
+# Stops each text at its first complete sentence (see sample_tokens): faster, but the comments get shorter
+STOP_AT_SENTENCE = os.getenv("STOP_AT_SENTENCE", "false").lower() == "true"
+
+_model = None
+_model_lock = threading.Lock()
+_warm_up_thread = None
+_full_stop_tokens = {}  # token id -> whether the token holds a full stop
+
+
+def linear_from_conv1d(conv):
+    """RETURNS the torch.nn.Linear layer computing the same as a gpt2 Conv1D layer
+    (whose weight is stored transposed), which the dynamic quantization of torch knows how to convert."""
+    import torch
+
+    linear = torch.nn.Linear(conv.weight.shape[0], conv.weight.shape[1])
+    linear.weight = torch.nn.Parameter(conv.weight.detach().t().contiguous())
+    linear.bias = torch.nn.Parameter(conv.bias.detach().clone())
+
+    return linear
+
+
+def quantize_model(model):
+    """Converts the gpt2 model for the int8 backend: its Conv1D layers are turned into linear layers,
+    then the weights of all the linear layers (the language modelling head included) are quantized to int8,
+    the activations being quantized on the fly at each forward pass.
+    RETURNS the quantized model, in evaluation mode.
+    ----
+    ARGUMENT: the gpt2 model (transformers GPT2LMHeadModel) with its fp32 weights.
+    """
+    import torch
+    from transformers.pytorch_utils import Conv1D  # transformers >= 4.19, only needed by the int8 backend
+
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, Conv1D):
+                setattr(module, name, linear_from_conv1d(child))
+
+    return torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_model(backend=MODEL_BACKEND):
+    """Loads the gpt2 model from MODEL_FOLDER with the given backend, and RETURNS it.
+    With the int8 backend, the model exported by export_quantized_model.py is loaded if there is one,
+    so that the fp32 weights never need to be read; otherwise pytorch_model.bin is quantized on loading."""
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend {backend!r}: choose among {', '.join(MODEL_BACKENDS)}.")
+    import torch
+    from aitextgen import aitextgen
+    from transformers import GPT2Config
+
+    logging.info(f"Loading the gpt2 model from {MODEL_FOLDER} ({backend})...")
+    if backend == "int8" and os.path.exists(QUANTIZED_MODEL_FILE):
+        ai = aitextgen(config=GPT2Config.from_pretrained(MODEL_FOLDER))
+        ai.model = quantize_model(ai.model)
+        ai.model.load_state_dict(torch.load(QUANTIZED_MODEL_FILE))
+    else:
+        ai = aitextgen(model_folder=MODEL_FOLDER)
+        if backend == "int8":
+            logging.info(f"No {QUANTIZED_MODEL_FILE}: quantizing the model (run export_quantized_model.py to skip it).")
+            ai.model = quantize_model(ai.model)
+    logging.info("The gpt2 model is loaded.")
+
+    return ai
+
+
+def warm_up_model():
+    """Starts loading the local model in a background thread, so that a service can answer its other requests
+    meanwhile; does nothing if the texts are generated by the inference server, if the model is already loaded,
+    or if it is being loaded. A failed loading can be retried by calling it again."""
+    global _warm_up_thread
+    if INFERENCE_SERVER_URL or _model is not None:
+        return
+    if _warm_up_thread is not None and _warm_up_thread.is_alive():
+        return
+
+    def warm_up():
+        try:
+            get_model()
+        except Exception:
+            logging.exception(f"The gpt2 model could not be loaded from {MODEL_FOLDER}.")
+
+    _warm_up_thread = threading.Thread(target=warm_up, name="model-warm-up", daemon=True)
+    _warm_up_thread.start()
+
+
+def model_status():
+    """RETURNS the status of the model used by the service:
+    "remote" if the texts are generated by the inference server, else "ready" once the local model is loaded,
+    "loading" while it is being loaded and "failed" if the last loading has failed."""
+    if INFERENCE_SERVER_URL:
+        return "remote"
+    if _model is not None:
+        return "ready"
+    if _warm_up_thread is not None and not _warm_up_thread.is_alive():
+        return "failed"
+
+    return "loading"
+
+
+def get_model():
+    """Loads the gpt2 model from MODEL_FOLDER, with the MODEL_BACKEND backend, the first time it is needed,
+    and RETURNS it."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = load_model()
+
+    return _model
+
+
+def encode_prompts(ai, prompts):
+    """Tokenizes the prompts, padded on the left so that every sequence goes on from its last real token.
+    RETURNS the input ids, the attention mask and the padding of the shortest prompt."""
+    tokenizer = ai.tokenizer
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    encoded = tokenizer(prompts, return_tensors="pt", padding=True)
+    input_ids = encoded["input_ids"].to(ai.model.device)
+    attention_mask = encoded["attention_mask"].to(ai.model.device)
+    padding = input_ids.shape[1] - int(attention_mask.sum(dim=1).min())
+
+    return input_ids, attention_mask, padding
+
+
+def ends_with_sentence(tokenizer, token_ids, token):
+    """Tells whether the sequence of token ids, whose last one is `token`, ends a complete first sentence:
+    the last token holds a full stop and the services would find a first sentence in the text so far.
+    The text is only decoded for the tokens holding a full stop."""
+    if token not in _full_stop_tokens:
+        _full_stop_tokens[token] = "." in tokenizer.decode([token])
+    if not _full_stop_tokens[token]:
+        return False
+    text = tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    return extract_first_sentence(text) is not None
+
+
+def sample_tokens(ai, prompts, min_length, max_length, temperature, top_p, repetition_penalty, no_repeat_ngram_size,
+                  stop_at_sentence=False, done=None, lock=None):
+    """Samples the continuations of the prompts token by token, reusing the cached keys and values of the model,
+    with the same sampling rules as ai.generate_one( ).
+    This is a generator: after each step it yields the LIST of the new token ids, one per prompt
+    (None for the sequences that were already finished).
+    A sequence is finished once it has produced the end-of-text token, or once the caller sets its flag in `done`;
+    with stop_at_sentence, also as soon as it holds a complete first sentence and is at least min_length long.
+    This changes the texts the services keep: extract_first_sentence( ) keeps everything up to the LAST full stop
+    of a text, so a text stopped early gives a shorter comment than the same text sampled up to max_length
+    (hence STOP_AT_SENTENCE, off by default).
+    With a lock, each step (one forward pass) runs under it and the lock is released between the steps,
+    so that several callers sharing the model take turns token by token.
+    ----
+    ARGUMENTS: the aitextgen model, a LIST of prompts (STRINGS), the sampling parameters,
+    and optionally the LIST of the `done` flags of the sequences, shared with the caller, and the lock of the model.
+    """
+    import torch
+    from transformers import (
+        LogitsProcessorList, MinLengthLogitsProcessor, NoRepeatNGramLogitsProcessor,
+        RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper, TopPLogitsWarper)
+
+    tokenizer = ai.tokenizer
+    step_lock = lock if lock is not None else nullcontext()
+    with step_lock:
+        input_ids, attention_mask, padding = encode_prompts(ai, prompts)
+    if done is None:
+        done = [False] * len(prompts)
+    sequences = [row[mask.bool()].tolist() for row, mask in zip(input_ids, attention_mask)]
+
+    processors = LogitsProcessorList([
+        MinLengthLogitsProcessor(min_length + padding, tokenizer.eos_token_id),
+        RepetitionPenaltyLogitsProcessor(repetition_penalty),
+        NoRepeatNGramLogitsProcessor(no_repeat_ngram_size),
+        TemperatureLogitsWarper(temperature),
+        TopPLogitsWarper(top_p)])
+
+    position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+    next_input_ids = input_ids
+    past_key_values = None
+
+    while input_ids.shape[1] < max_length + padding and not all(done):
+        with step_lock, torch.no_grad():
+            outputs = ai.model(
+                input_ids=next_input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True)
+            past_key_values = outputs.past_key_values
+
+            scores = processors(input_ids, outputs.logits[:, -1, :])
+            tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            finished = torch.tensor(done, device=tokens.device)
+            tokens = tokens.masked_fill(finished, tokenizer.pad_token_id)
+
+            input_ids = torch.cat([input_ids, tokens[:, None]], dim=1)
+            attention_mask = torch.cat([attention_mask, (~finished).long()[:, None]], dim=1)
+            position_ids = position_ids[:, -1:] + 1
+            next_input_ids = tokens[:, None]
+
+            new_tokens = [None if was_done else token for was_done, token in zip(done, tokens.tolist())]
+            long_enough = input_ids.shape[1] >= min_length + padding
+            for i, token in enumerate(new_tokens):
+                if token is None:
+                    continue
+                sequences[i].append(token)
+                if token == tokenizer.eos_token_id:
+                    done[i] = True
+                elif stop_at_sentence and long_enough and ends_with_sentence(tokenizer, sequences[i], token):
+                    done[i] = True
+        yield new_tokens
+
+
+def stream_local(ai, prompt, **sampling):
+    """Generates a text from the prompt and yields it piece by piece, as soon as each token is sampled
+    (the prompt comes first). A piece is held back while it ends with an incomplete multi-byte character."""
+    tokenizer = ai.tokenizer
+    yield prompt
+
+    token_ids = []
+    emitted = ""
+    for tokens in sample_tokens(ai, [prompt], **sampling):
+        if tokens[0] is None or tokens[0] == tokenizer.eos_token_id:
+            break
+        token_ids.append(tokens[0])
+        text = tokenizer.decode(token_ids, skip_special_tokens=True)
+        if not text.endswith("\ufffd"):
+            yield text[len(emitted):]
+            emitted = text
+
+
+def generate_batch(ai, prompts, **sampling):
+    """Samples one text per prompt in a single padded forward pass of the gpt2 model.
+    Prompts are padded on the left, so that every sequence goes on from its last real token;
+    the length limits apply to the shortest prompt as in ai.generate_one( ).
+    With stop_at_sentence, each sequence stops on its own at the end of its first sentence.
+    RETURNS the LIST of texts (prompts included), in the order of the prompts.
+    ----
+    ARGUMENTS: the aitextgen model, a LIST of prompts (STRINGS) and the sampling parameters (see sample_tokens( )).
+    """
+    tokenizer = ai.tokenizer
+    generated = [[] for _ in prompts]
+    for tokens in sample_tokens(ai, prompts, **sampling):
+        for sequence, token in zip(generated, tokens):
+            if token is not None:
+                sequence.append(token)
+
+    return [prompt + tokenizer.decode(sequence, skip_special_tokens=True)
+            for prompt, sequence in zip(prompts, generated)]
+
+
+def generate_remote(prompts, **sampling):
+    """Sends the prompts and the sampling parameters to the inference server
+    and RETURNS the LIST of texts it has generated, in the order of the prompts."""
+    resp = requests.post(
+        f"{INFERENCE_SERVER_URL}/generate",
+        json={"prompts": prompts, "sampling": sampling},
+        timeout=INFERENCE_TIMEOUT)
+    resp.raise_for_status()
+
+    return resp.json()["texts"]
+
+
+def stream_remote(prompt, **sampling):
+    """Asks the inference server to stream a text from the prompt, and yields the pieces as they arrive."""
+    with requests.post(
+            f"{INFERENCE_SERVER_URL}/generate/stream",
+            json={"prompt": prompt, "sampling": sampling},
+            stream=True,
+            timeout=INFERENCE_TIMEOUT) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if line:
+                yield json.loads(line)["text"]
+
+
+def stream_text(prompt, **sampling):
+    """Generates a text from the prompt, on the inference server if INFERENCE_SERVER_URL is set
+    or with the local model, and yields it piece by piece as it is sampled (the prompt comes first).
+    ----
+    ARGUMENTS: a prompt (STRING) and the sampling parameters, as keyword arguments.
+    """
+    if INFERENCE_SERVER_URL:
+        return stream_remote(prompt, **sampling)
+
+    return stream_local(get_model(), prompt, **sampling)
+
+
+def generate_texts(prompts, batch_size, **sampling):
+    """Generates one text per prompt, either on the inference server if INFERENCE_SERVER_URL is set
+    or with the local model, batch_size prompts per forward pass.
+    RETURNS the LIST of texts (prompts included), in the order of the prompts.
+    ----
+    ARGUMENTS:
+    1) a LIST of prompts (STRINGS);
+    2) the number of prompts sampled together by the local model;
+    3) the sampling parameters, as keyword arguments (min_length, max_length, temperature, top_p, ...).
+    """
+    if INFERENCE_SERVER_URL:
+        return generate_remote(prompts, **sampling)
+
+    ai = get_model()
+    texts = []
+    for start in range(0, len(prompts), batch_size):
+        texts.extend(generate_batch(ai, prompts[start:start + batch_size], **sampling))
+
+    return texts
+
+
+def generate_candidates(prompts, candidates, batch_size, **sampling):
+    """Over-generates: samples `candidates` texts per prompt, all the candidates of a prompt
+    going through the same batched forward pass, so that the services can keep the first usable one
+    instead of running a whole new generation when a text is not.
+    RETURNS a LIST holding, for each prompt, the LIST of its candidate texts.
+    ----
+    ARGUMENTS:
+    1) a LIST of prompts (STRINGS);
+    2) the number of candidates per prompt;
+    3) the number of prompts whose candidates are sampled together by the local model;
+    4) the sampling parameters, as keyword arguments.
+    """
+    texts = generate_texts(
+        [prompt for prompt in prompts for _ in range(candidates)], batch_size * candidates, **sampling)
+
+    return [texts[start:start + candidates] for start in range(0, len(texts), candidates)]
@@ -0,0 +1,24 @@
+"""
+This module contains the query of the section pages of the webapp, shared by the webapp (app_functions)
+and by the check of its read path in the article collector (check_section_index.py),
+so that the query that is checked is the query that is served.
+"""
+
+from sqlalchemy.sql import text
+
+
+SECTION_QUERY = text("""SELECT date,
+                              title,
+                              author,
+                              body,
+                              img_url,
+                              img_descr,
+                              img_cred,
+                              short_url,
+                              marx_comment,
+                              marx_judgement 
+                        FROM guardian_articles
+                        WHERE section_id = :section
+                        ORDER BY date DESC
+                        LIMIT 5
+                        ;""")
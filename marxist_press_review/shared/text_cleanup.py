@@ -0,0 +1,113 @@
+"""
+This module contains the regex cleanup shared by the services of the press review and by the preprocessor:
+1) the cleanup of the texts generated by the gpt2 model, and the extraction of their first complete sentence;
+2) the cleanup of the paragraphs of the training dataset.
+The patterns are compiled once and applied cumulatively, in order. Each pass is made as cheap as possible:
+literal patterns are replaced with str.replace( ), and a regex pass is skipped altogether
+when the text holds none of the substrings its pattern needs to match.
+(Merging the patterns into alternations was measured slower with the re module: see benchmark_text_cleanup.py.)
+"""
+
+import re
+
+
+NO_TRUNC_INITIAL_SENTENCE_PATTERN = re.compile(r"^[A-Z][a-z]+.+\.")
+
+# Cleanup of the generated texts, applied in this order
+GENERATION_REGEX = {
+    r"\n": " ",
+    r"\\'": "’",
+    r"\[.+?\]": "",
+    r"\[.+?\.": ".",
+    r"  [0-9]+.": "",
+    r"\(\?\)": "",
+    r"\([0-9]{1,2}\)": "",
+    r"[<>]": "",
+    r"\.+": ".",
+    r" \. ": ". ",
+    r"\|\|[A-Z]+\|": "",
+    r"(\.)[A-Za-z0-9]+": ". ",
+    r" {2,}": " ",
+    r'''(.\")[A-Za-z0-9]''': '. "'
+}
+
+# Cleanup of the paragraphs of the training dataset, applied in this order
+PREPROCESSING_REGEX = {
+    r"\\'": "’",
+    r"\[.+?\]": "",
+    r"  [0-9]+.": "",
+    r"\(\?\)": "",
+    r"\([0-9]{1,2}\)": "",
+    r"[<>]": "",
+    r"\.+": ".",
+    r" \. ": ". ",
+    r"\|\|[A-Z]+\|": "",
+    r" {2,}": " "
+}
+
+# Patterns matching a single literal string, replaced without the re module
+LITERALS = {
+    r"\n": "\n",
+    r"\\'": "\\'"
+}
+
+# Substrings without which a pattern cannot match
+REQUIRED_SUBSTRINGS = {
+    r"\[.+?\]": ("[",),
+    r"\[.+?\.": ("[",),
+    r"  [0-9]+.": ("  ",),
+    r"\(\?\)": ("(?)",),
+    r"\([0-9]{1,2}\)": ("(",),
+    r"[<>]": ("<", ">"),
+    r"\.+": (".",),
+    r" \. ": (" . ",),
+    r"\|\|[A-Z]+\|": ("||",),
+    r"(\.)[A-Za-z0-9]+": (".",),
+    r" {2,}": ("  ",),
+    r'''(.\")[A-Za-z0-9]''': ('"',)
+}
+
+
+def compile_cleanup(regex):
+    """Turns a dictionary of patterns and replacements into the LIST of passes of the cleanup,
+    each pass being a (literal or compiled pattern, replacement, required substrings) tuple."""
+    passes = []
+    for pattern, replacement in regex.items():
+        if pattern in LITERALS:
+            passes.append((LITERALS[pattern], replacement, None))
+        else:
+            passes.append((re.compile(pattern), replacement, REQUIRED_SUBSTRINGS.get(pattern)))
+
+    return passes
+
+
+GENERATION_CLEANUP = compile_cleanup(GENERATION_REGEX)
+PREPROCESSING_CLEANUP = compile_cleanup(PREPROCESSING_REGEX)
+
+
+def clean_text(text, passes):
+    """Applies the passes of a cleanup (see compile_cleanup( )) one after the other to a text, and RETURNS it."""
+    for pattern, replacement, required in passes:
+        if isinstance(pattern, str):
+            text = text.replace(pattern, replacement)
+        elif required is None or any(substring in text for substring in required):
+            text = pattern.sub(replacement, text)
+
+    return text
+
+
+def clean_generated_text(text):
+    """Cleans a text generated by the gpt2 model."""
+    return clean_text(text, GENERATION_CLEANUP)
+
+
+def clean_training_text(text):
+    """Cleans a paragraph of the training dataset."""
+    return clean_text(text, PREPROCESSING_CLEANUP)
+
+
+def extract_first_sentence(text):
+    """Cleans a text generated by the gpt2 model and RETURNS its first complete sentence, or None if there is none."""
+    sentence = NO_TRUNC_INITIAL_SENTENCE_PATTERN.match(clean_generated_text(text))
+
+    return None if sentence is None else sentence.group(0)